@@ -11,23 +11,72 @@ from .autogen.autogen_nativeformat import *
 from .misc import *
 from .stacktrace_parser import *
 from .autogen.autogen_nativeformat_enums import *
+from .headless import *
+from .session import *
+from .cache import *
+from .sqlite_export import *
 
 import importlib
 
-def doit(bv):
-    utils.initialize_utils(bv)
+#returns the AotSession for bv so it can be poked at from the console
+#with use_cache the sections and the decoded metadata come from (or go into) the on-disk cache, see cache.py, and so does the hydrated image, see rehydrate.py. session.cache has everything that was decoded
+#tables are the cache tables to decode, only 'stacktrace' is applied here but e.g. cache.ALL_TABLES gets everything the exporter needs in one go
+#modules_array is the address of the array passed to InitializeModules (and count its length), if known. It is the fastest way to find the ReadyToRun headers, see rtr.locate_ready_to_run_headers
+#every module in the binary is processed, session is the first one and session.modules has all of them
+def doit(bv, use_cache=True, cache_dir=None, modules_array=None, count=None, tables=cache.DEFAULT_TABLES):
+    session = AotSession(bv)
     rtr.initialize_types(bv)
-    rtr.populate_sections(bv)
-    rehydrate.do_rehydration(bv)
-    nativeformat.create_metadata_reader()
-    #method_parser.parse_methods()
-    stacktrace_parser.stacktrace_metadata_dumper(bv)
+    (digest, data) = cache.load_cached_sections(session, cache_dir) if use_cache else (None, None)
+    if data is None:
+        rtr.populate_sections(session, modules_array, count)
+    for module in session.modules: #rehydration writes into the view, so one module at a time
+        rehydrate.do_rehydration(module, use_cache)
+    #nothing gets decoded when the cache has every table, so don't bother indexing the varints
+    index_varints = data is None or not cache.has_tables(data, tables)
+    map_modules(session, lambda module: nativeformat.create_metadata_reader(module, index_varints))
+    #method_parser.parse_methods(session)
+    if use_cache:
+        cache.load_or_build_cache(session, cache_dir, tables=tables, digest=digest, data=data)
+        stacktrace_parser.apply_stacktrace_symbols(bv, cache.merge_modules(session.cache, 'stacktrace'))
+    else: #decode every module first so the symbols are applied in one batch
+        symbols = list()
+        for module in session.modules:
+            if module.metadata_reader is not None:
+                symbols += stacktrace_parser.decode_stacktrace_symbols(module)
+        stacktrace_parser.apply_stacktrace_symbols(bv, symbols)
+    return session
+
+#same pipeline as doit but on a PE file on disk, without Binary Ninja. Nothing is annotated, the (address, name) pairs from the stack trace metadata are returned alongside the session instead
+#workers spreads rehydration and the hashtable enumerations over that many processes
+#the result unpacks as (session, symbols) and can be used in a with block, which closes the PE file at the end (see AotSession.close)
+def doit_headless(path, use_cache=True, cache_dir=None, modules_array=None, count=None, workers=None, tables=cache.DEFAULT_TABLES):
+    session = AotSession(headless.PEImage(path))
+    try:
+        (digest, data) = cache.load_cached_sections(session, cache_dir) if use_cache else (None, None)
+        if data is None:
+            rtr.populate_sections(session, modules_array, count)
+        for module in session.modules:
+            rehydrate.do_rehydration(module, use_cache, workers)
+        index_varints = data is None or not cache.has_tables(data, tables)
+        map_modules(session, lambda module: nativeformat.create_metadata_reader(module, index_varints))
+        if use_cache:
+            cache.load_or_build_cache(session, cache_dir, workers, tables, digest, data)
+            symbols = [tuple(symbol) for symbol in cache.merge_modules(session.cache, 'stacktrace')]
+        else:
+            symbols = list()
+            for module in session.modules:
+                if module.metadata_reader is not None:
+                    symbols += stacktrace_parser.stacktrace_metadata_dumper(module)
+    except:
+        session.close()
+        raise
+    return HeadlessResult(session, symbols)
 
 '''
 to reload in binja run the following line in the binja console:
 
 for m in [x for x in sys.modules if 'aot_dotnet' in x]:  
     del sys.modules[m]
-del aot_dotnet; import aot_dotnet; aot_dotnet.doit(bv)
+del aot_dotnet; import aot_dotnet; session = aot_dotnet.doit(bv)
 
 '''
\ No newline at end of file
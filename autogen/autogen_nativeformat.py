@@ -1,8 +1,12 @@
-from binaryninja import *
 from ..utils import *
 from ..dotnet_enums import *
 from .autogen_nativeformat_enums import *
 from .autogen_nativeformat_primitives import *
+from array import array
+try:
+    import numpy
+except ImportError: #numpy is optional, it's only needed for NativePrimitiveCollection.to_numpy
+    numpy = None
 
 #https://github.com/dotnet/runtime/blob/ecd5ee7277b1eb33bed4cc91ce7abee609bbbd71/src/coreclr/nativeaot/System.Private.CoreLib/src/System/RuntimeTypeHandle.cs#L17
 
@@ -12,7 +16,8 @@ from .autogen_nativeformat_primitives import *
 
 #TODO: This needs to be moved to its own class as this si not part of the 
 class RuntimeTypeHandle:
-    def __init__(self, value):  
+    def __init__(self, session, value):  
+        self.session = session #the MethodTable lives in the session's binary
         self.val = value #the value is the vtable for that object
     
     def GetHashCode(self):
@@ -27,7 +32,7 @@ class RuntimeTypeHandle:
         return False
     
     def __hash__(self):
-        return read32(self.val + 0x14)
+        return self.session.read32(self.val + 0x14)
     
 
 
@@ -64,49 +69,78 @@ In other words, suppose we have TypeDefinitionHandle. Then its read will look li
 '''
 
 
+#A handle is just a packed int: the top 8 bits are the hType and the bottom 24 bits are the offset. Every typed handle (MethodHandle, TypeDefinitionHandle, ...) is a __slots__ view over that same int, so there is no per-handle dict and the hType is only turned into a HandleType when asked for
 class NativeFormatHandle:
+    __slots__ = ('_packed',)
+    HANDLE_TYPE = None #the HandleType a typed handle is supposed to hold (besides Null)
+
     def __init__(self, value):
         if isinstance(value, NativeFormatHandle): #if it is an instance of NativeFormatHandle then it is a cross-handle cast, so basically just copy it over
-            self._hType = value._hType
-            self._value = value._value
+            hType = value._packed >> 24
+            if self.HANDLE_TYPE is not None and hType != HandleType.Null and hType != self.HANDLE_TYPE:
+                raise ValueError(f"Can't make a {type(self).__name__} out of a {HANDLE_TYPES[hType]!r} handle")
+            self._packed = value._packed
         else:
-            self._hType = HandleType(s32(value) >> 24)
-            self._value = (value & 0x0FFFFFF)
+            self._packed = value & 0xFFFFFFFF
 
     @property
     def value(self):
-        return self._value
+        return self._packed & 0x0FFFFFF
     
     def AsInt(self):
-        return self._value
+        return self._packed & 0x0FFFFFF
 
     @property
     def hType(self):
-        return self._hType
+        return HANDLE_TYPES[self._packed >> 24]
 
     @property
     def Offset(self):
-        return s32(self._value & 0x0FFFFFF)
+        return self._packed & 0x0FFFFFF
+
+    def IsNull(self):
+        return (self._packed >> 24) == HandleType.Null
+
+    def __eq__(self, other):
+        if isinstance(other, NativeFormatHandle):
+            return self._packed == other._packed
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._packed)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.hType!r}, {hex(self.Offset)})"
     
     #This method should NEVER be called directly. Instead, it should be called by a subclass
     #Pulled from https://github.com/dotnet/runtime/blob/e133fe4f5311c0397f8cc153bada693c48eb7a9f/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/Generator/MdBinaryReaderGen.cs#L101
     #returns the new offset as well as the newly created handle. All handles have the same read. The only difference is the returned object - the underlying value is read the same way
     def Read(reader, offset, handle_type):
         (offset, value) = reader.DecodeUnsigned(offset)
-        handle = handle_type(s32(value))
-        return (offset, handle)
+        return (offset, handle_type(value))
+
+    #builds a handle out of the raw value that Read decodes, see NativeFormatCollection.RawValues
+    @classmethod
+    def FromRaw(cls, value):
+        return cls(value)
 
 #This class is intended for Handle collections. Evidence for this can be seen here: 
+#Collections can also be indexed and sliced like a list (collection[i], collection[i:j], len(collection)) as long as they know their ELEMENT_TYPE. The offset of every element is worked out once per collection (shared through the VarintIndex if there is one) so collection[n] doesn't have to decode the n-1 elements before it
 class NativeFormatCollection:
+    ELEMENT_TYPE = None #name of the handle type of the elements. A name because some handle types are defined after their collection
+
     def __init__(self, reader, offset):
         self.reader = reader
         self.offset = offset
+        self._element_offsets = None
 
     # pulled from: https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/Generator/MdBinaryReaderGen.cs#L62
     #returns the new offset and the newly created collection
     #All collections have the same Read. The only difference is the actual type of the collection that is returned
     def Read(reader, offset, subclass):
         values = subclass(reader, offset) 
+        if reader.varint_index is not None: #the end of the collection is memoized after the first walk
+            return (reader.varint_index.CollectionEnd(offset), values)
         (offset, count) = reader.DecodeUnsigned(offset)
         for _ in range(count):
             offset = reader.SkipInteger(offset)
@@ -119,23 +153,83 @@ class NativeFormatCollection:
         (_, count) = self.reader.DecodeUnsigned(self.offset)
         return s32(count)
     
+    #Raw iteration for handle collections. These yield plain ints and never build a handle object, which is what bulk consumers want
+    #ElementOffsets yields the offset of every element and RawValues yields the raw (still packed) value of every element, i.e. what elem_type.FromRaw takes
+    def ElementOffsets(self):
+        return collection_element_offsets(self.reader, self.offset)
+
+    def RawValues(self):
+        return collection_raw_values(self.reader, self.offset)
+
+    #array of the offset of every element
+    def GetElementOffsets(self):
+        if self.reader.varint_index is not None:
+            return self.reader.varint_index.ElementOffsets(self.offset)
+        if self._element_offsets is None:
+            self._element_offsets = array('I', collection_element_offsets(self.reader, self.offset))
+        return self._element_offsets
+
+    def GetElementType(self):
+        if self.ELEMENT_TYPE is None:
+            raise TypeError(f"{type(self).__name__} doesn't have an element type")
+        return globals()[self.ELEMENT_TYPE]
+
+    def __len__(self):
+        (_, count) = self.reader.DecodeUnsigned(self.offset)
+        return count
+
+    def __getitem__(self, index):
+        elem_type = self.GetElementType()
+        offsets = self.GetElementOffsets()
+        if isinstance(index, slice):
+            return [elem_type.Read(self.reader, offset)[1] for offset in offsets[index]]
+        (_, element) = elem_type.Read(self.reader, offsets[index])
+        return element
+
+    def __iter__(self):
+        return NativeFormatCollection.Enumerator(self.reader, self.offset, self.GetElementType())
+
     #All enumerators are the same except the type that is read upon going next
+    #Handle elements are built on top of collection_raw_values. Everything else (the primitive collections) is read one element after the other
     class Enumerator:
         def __init__(self, reader, offset, elem_type):
             self.reader = reader
             self.offset = offset
-            (self.offset, self.remaining) = reader.DecodeUnsigned(self.offset)
             self.elem_type = elem_type #elem_type is a custom type that denotes the element that this is a collection of
+            if isinstance(elem_type, type) and issubclass(elem_type, NativeFormatHandle):
+                self.values = collection_raw_values(reader, offset)
+                return
+            self.values = None
+            (self.offset, self.remaining) = reader.DecodeUnsigned(self.offset)
         
         def __iter__(self):
             return self
         
         def __next__(self):
+            if self.values is not None:
+                return self.elem_type.FromRaw(next(self.values))
             if self.remaining == 0:
                 raise StopIteration
             self.remaining -= 1
             (self.offset, current) = self.elem_type.Read(self.reader, self.offset)
             return current
+
+#offset is the offset of the collection (its count). Elements of handle collections are all single varints
+def collection_element_offsets(reader, offset):
+    if reader.varint_index is not None:
+        yield from reader.varint_index.ElementOffsets(offset)
+        return
+    (offset, count) = reader.DecodeUnsigned(offset)
+    for _ in range(count):
+        yield offset
+        offset = reader.SkipInteger(offset)
+
+def collection_raw_values(reader, offset):
+    decode_unsigned = reader.DecodeUnsigned
+    (offset, count) = decode_unsigned(offset)
+    for _ in range(count):
+        (offset, value) = decode_unsigned(offset)
+        yield value
     
 
 
@@ -146,6 +240,8 @@ This is used in cases where handles are overloaded such as https://github.com/do
 '''
 
 class Handle(NativeFormatHandle):
+    __slots__ = ()
+
     def __init__(self, value, hType=None):
         if hType != None: #This is used for manually constructing a Handle given a value and a handle type
             super().__init__(hType << 24 | value)
@@ -155,10 +251,20 @@ class Handle(NativeFormatHandle):
     #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/MdBinaryReader.cs#L77
     def Read(reader, offset):
         (offset, value) = reader.DecodeUnsigned(offset)
-        return (offset, Handle(s32(value >> 8), hType=HandleType(s8(value))))
+        return (offset, Handle.FromRaw(value))
+
+    #a generic handle is stored with the hType in the low byte instead of the top byte
+    @classmethod
+    def FromRaw(cls, value):
+        hType = HANDLE_TYPES[value & 0xff]
+        if hType is None:
+            raise ValueError('Bad Image Format Exception')
+        return cls(value >> 8, hType=hType)
 
 
 class HandleCollection(NativeFormatCollection):
+    ELEMENT_TYPE = 'Handle'
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
     
@@ -168,12 +274,61 @@ class HandleCollection(NativeFormatCollection):
     def GetEnumerator(self):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, Handle)
 
+'''
+LazyRecord
+
+The records below used to decode every one of their fields in __init__, including walking every collection they own, even though most callers only want the name. A LazyRecord instead just remembers where it starts. FIELDS lists (name, type) in the order they appear in the blob and the first time a field is touched, it and every field before it are read (each field's offset is only known once the one before it has been read). The offset right after the last decoded field is kept so later fields pick up from there instead of starting over.
+
+Decoded fields end up as normal attributes so __getattr__ is only ever hit once per field.
+'''
+class LazyRecord:
+    FIELDS = () #(name, name of the type that reads it). Names because most of the types are defined further down this file
+
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+        cls.FIELD_INDEX = {name: i for (i, (name, _)) in enumerate(cls.FIELDS)}
+        cls.FIELD_TYPES = None #resolved on first decode
+
+    def __init__(self, reader, handle):
+        self.reader = reader
+        self.handle = handle
+        self._decoded = 0 #number of FIELDS that have been read
+        self._next_offset = handle.Offset #offset of FIELDS[self._decoded]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        index = type(self).FIELD_INDEX.get(name)
+        if index is None:
+            raise AttributeError(name)
+        self._decode_through(index)
+        return self.__dict__[name]
+
+    def _decode_through(self, index):
+        cls = type(self)
+        if cls.FIELD_TYPES is None:
+            cls.FIELD_TYPES = tuple(globals()[type_name] for (_, type_name) in cls.FIELDS)
+        streamReader = self.reader.streamReader
+        offset = self._next_offset
+        for i in range(self._decoded, index+1):
+            (offset, self.__dict__[cls.FIELDS[i][0]]) = cls.FIELD_TYPES[i].Read(streamReader, offset)
+        self._decoded = max(self._decoded, index+1)
+        self._next_offset = offset
+
+    #decode everything that hasn't been decoded yet
+    def decode_all(self):
+        if self.FIELDS:
+            self._decode_through(len(self.FIELDS)-1)
+        return self
+
 '''
 ------ScopeDefinition------
 '''
 
 #https://github.com/dotnet/runtime/blob/a72cfb0ee2669abab031c5095a670678fd0b7861/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L6193
 class ScopeDefinitionHandleCollection(NativeFormatCollection):
+    ELEMENT_TYPE = 'ScopeDefinitionHandle'
+
     def __init__(self,reader, offset):
         super().__init__(reader, offset)
         
@@ -184,40 +339,38 @@ class ScopeDefinitionHandleCollection(NativeFormatCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, ScopeDefinitionHandle)
     
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4575
-class ScopeDefinition:
-    def __init__(self, reader, handle):
-        self.reader = reader
-        self.handle = handle
-        offset = handle.Offset
-        streamReader = reader.streamReader
-        (offset, self.flags) = AssemblyFlags.Read(streamReader, offset)
-        (offset, self.name) = ConstantStringValueHandle.Read(streamReader, offset)
-        (offset, self.hashAlgorithm) = AssemblyHashAlgorithm.Read(streamReader, offset)
-        (offset, self.majorVersion) = UInt16.Read(streamReader, offset)
-        (offset, self.minorVersion) = UInt16.Read(streamReader, offset)
-        (offset, self.buildNumber) = UInt16.Read(streamReader, offset)
-        (offset, self.revisionNumber) = UInt16.Read(streamReader, offset)
-        (offset, self.publicKey) =  ByteCollection.Read(streamReader, offset)
-        (offset, self.culture) = ConstantStringValueHandle.Read(streamReader, offset)
-        (offset, self.rootNamespaceDefinition) = NamespaceDefinitionHandle.Read(streamReader, offset)
-        (offset, self.entryPoint) = QualifiedMethodHandle.Read(streamReader, offset)
-        (offset, self.globalModuleType) = TypeDefinitionHandle.Read(streamReader, offset)
-        (offset, self.customAttributes) = CustomAttributeHandleCollection.Read(streamReader, offset)
-        (offset, self.moduleName) = ConstantStringValueHandle.Read(streamReader, offset)
-        (offset, self.mvid) = ByteCollection.Read(streamReader, offset)
-        (offset, self.moduleCustomAttributes) = CustomAttributeHandleCollection.Read(streamReader, offset)
+class ScopeDefinition(LazyRecord):
+    HANDLE_TYPE = HandleType.ScopeDefinition
+
+    FIELDS = (
+        ('flags', 'AssemblyFlags'),
+        ('name', 'ConstantStringValueHandle'),
+        ('hashAlgorithm', 'AssemblyHashAlgorithm'),
+        ('majorVersion', 'UInt16'),
+        ('minorVersion', 'UInt16'),
+        ('buildNumber', 'UInt16'),
+        ('revisionNumber', 'UInt16'),
+        ('publicKey', 'ByteCollection'),
+        ('culture', 'ConstantStringValueHandle'),
+        ('rootNamespaceDefinition', 'NamespaceDefinitionHandle'),
+        ('entryPoint', 'QualifiedMethodHandle'),
+        ('globalModuleType', 'TypeDefinitionHandle'),
+        ('customAttributes', 'CustomAttributeHandleCollection'),
+        ('moduleName', 'ConstantStringValueHandle'),
+        ('mvid', 'ByteCollection'),
+        ('moduleCustomAttributes', 'CustomAttributeHandleCollection'),
+    )
         
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4658
 class ScopeDefinitionHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.ScopeDefinition or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.ScopeDefinition
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetScopeDefinition(self, reader):
-        return ScopeDefinition(reader, self)
+        return reader.GetRecord(ScopeDefinition, self)
     
 '''
 NamespaceDefinition
@@ -225,18 +378,19 @@ NamespaceDefinition
 
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L3833
 class NamespaceDefinitionHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.NamespaceDefinition or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.NamespaceDefinition
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetNamespaceDefinition(self, reader):
-        return NamespaceDefinition(reader, self)
+        return reader.GetRecord(NamespaceDefinition, self)
 
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L3793
 class NamespaceDefinition:
+    HANDLE_TYPE = HandleType.NamespaceDefinition
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -249,6 +403,8 @@ class NamespaceDefinition:
         (offset, self.namespaceDefinitions) = NamespaceDefinitionHandleCollection.Read(streamReader, offset)
         
 class NamespaceDefinitionHandleCollection(NativeFormatCollection):
+    ELEMENT_TYPE = 'NamespaceDefinitionHandle'
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
     
@@ -280,9 +436,8 @@ QualifiedMethod
 '''
 
 class QualifiedMethodHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.QualifiedMethod or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.QualifiedMethod
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
@@ -293,18 +448,19 @@ TypeDefinition
 
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4900
 class TypeDefinitionHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.TypeDefinition or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.TypeDefinition
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetTypeDefinition(self, reader):
-        return TypeDefinition(reader, self)
+        return reader.GetRecord(TypeDefinition, self)
     
     
 class TypeDefinitionHandleCollection(NativeFormatCollection):
+    ELEMENT_TYPE = 'TypeDefinitionHandle'
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
     
@@ -316,24 +472,23 @@ class TypeDefinitionHandleCollection(NativeFormatCollection):
     
 
 #https://github.com/dotnet/runtime/blob/d8208737f8b1ede2c6673a89769dc29fb7a7f6af/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4819
-class TypeDefinition:
-    def __init__(self, reader, handle):
-        self.reader = reader
-        self.handle = handle
-        offset = handle.Offset
-        streamReader = reader.streamReader
-        (offset, self.flags) = streamReader.DecodeUnsigned(offset)#TypeAttributes.Read(streamReader, offset) - TODO: TypeAttributes is broken
-        (offset, self.baseType) = Handle.Read(streamReader, offset)
-        (offset, self.namespaceDefinition) = NamespaceDefinitionHandle.Read(streamReader, offset)
-        (offset, self.name) = ConstantStringValueHandle.Read(streamReader, offset)
-        (offset, self.size) = UInt32.Read(streamReader, offset)
-        (offset, self.packingSize) = UInt16.Read(streamReader, offset)
-        (offset, self.enclosingType) = TypeDefinitionHandle.Read(streamReader, offset)
-        (offset, self.nestedTypes) = TypeDefinitionHandleCollection.Read(streamReader, offset)
-        (offset, self.methods) = MethodHandleCollection.Read(streamReader, offset)
-        (offset, self.fields) = FieldHandleCollection.Read(streamReader, offset)
-        #(offset, self.properties) = PropertyHandleCollection.Read(streamReader, offset)
-        #(offset, self.events) = EventHandleCollection.Read(streamReader, offset)
+class TypeDefinition(LazyRecord):
+    HANDLE_TYPE = HandleType.TypeDefinition
+
+    FIELDS = (
+        ('flags', 'UInt32'), #TypeAttributes - TODO: TypeAttributes is broken
+        ('baseType', 'Handle'),
+        ('namespaceDefinition', 'NamespaceDefinitionHandle'),
+        ('name', 'ConstantStringValueHandle'),
+        ('size', 'UInt32'),
+        ('packingSize', 'UInt16'),
+        ('enclosingType', 'TypeDefinitionHandle'),
+        ('nestedTypes', 'TypeDefinitionHandleCollection'),
+        ('methods', 'MethodHandleCollection'),
+        ('fields', 'FieldHandleCollection'),
+        #('properties', 'PropertyHandleCollection'),
+        #('events', 'EventHandleCollection'),
+    )
         
     def get_name(self, reader):
         return self.name.GetConstantStringValue(reader)
@@ -357,12 +512,41 @@ Field
 
 #https://github.com/dotnet/runtime/blob/a72cfb0ee2669abab031c5095a670678fd0b7861/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L5572
 class FieldHandleCollection(NativeFormatCollection):
+    ELEMENT_TYPE = 'FieldHandle'
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
     
     def Read(reader, offset):
         return NativeFormatCollection.Read(reader, offset, __class__)
 
+    def GetEnumerator(self):
+        return NativeFormatCollection.Enumerator(self.reader, self.offset, FieldHandle)
+
+#https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs
+class FieldHandle(NativeFormatHandle):
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.Field
+
+    def Read(reader, offset):
+        return NativeFormatHandle.Read(reader, offset, __class__)
+
+    def GetField(self, reader):
+        return reader.GetRecord(Field, self)
+
+#https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs
+class Field(LazyRecord):
+    HANDLE_TYPE = HandleType.Field
+
+    FIELDS = (
+        ('flags', 'FieldAttributes'),
+        ('name', 'ConstantStringValueHandle'),
+        ('signature', 'FieldSignatureHandle'),
+        ('defaultValue', 'Handle'),
+        ('offset', 'UInt32'),
+        ('customAttributes', 'CustomAttributeHandleCollection'),
+    )
+
 '''
 Parameter
 '''
@@ -407,34 +591,34 @@ class CustomAttributeHandleCollection(NativeFormatCollection):
 '''    
 
 # pulled from: https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L3175
-class Method:
-    def __init__(self, reader, handle):
-        self.reader = reader
-        self.handle = handle
-        offset = u32(handle.Offset)
-        streamReader = reader.streamReader
-        (offset, self.flags) = MethodAttributes.Read(streamReader, offset)
-        (offset, self.implFlags) = MethodImplAttributes.Read(streamReader, offset)
-        (offset, self.name) = ConstantStringValueHandle.Read(streamReader, offset) 
-        (offset, self.signature) = MethodSignatureHandle.Read(streamReader, offset) 
-        (offset, self.parameters) = ParameterHandleCollection.Read(streamReader, offset)
-        (offset, self.genericParameters) = GenericParameterHandleCollection.Read(streamReader, offset)
-        (offset, self.customAttributes) = CustomAttributeHandleCollection.Read(streamReader, offset)
+class Method(LazyRecord):
+    HANDLE_TYPE = HandleType.Method
+
+    FIELDS = (
+        ('flags', 'MethodAttributes'),
+        ('implFlags', 'MethodImplAttributes'),
+        ('name', 'ConstantStringValueHandle'),
+        ('signature', 'MethodSignatureHandle'),
+        ('parameters', 'ParameterHandleCollection'),
+        ('genericParameters', 'GenericParameterHandleCollection'),
+        ('customAttributes', 'CustomAttributeHandleCollection'),
+    )
         
 
 # pulled from: https://github.com/dotnet/runtime/blob/a72cfb0ee2669abab031c5095a670678fd0b7861/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L3221
 class MethodHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.Method or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.Method
 
     def GetMethod(self, reader):
-        return Method(reader, self)
+        return reader.GetRecord(Method, self)
     
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
         
 class MethodHandleCollection(NativeFormatCollection):
+    ELEMENT_TYPE = 'MethodHandle'
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
     
@@ -449,25 +633,31 @@ class MethodHandleCollection(NativeFormatCollection):
 ------ConstantString------
 '''
 #this was retrieved from the disassembly
+#the string itself comes out of the MetadataReader's StringPool, and only the first time value is touched
 class ConstantStringValue:
+    HANDLE_TYPE = HandleType.ConstantStringValue
+
     def __init__(self, reader, handle):
         self.reader = reader
-        streamReader = reader.streamReader
-        (_, self.value) = String.Read(streamReader, handle.Offset)
+        self.handle = handle
+
+    @property
+    def value(self):
+        return self.reader.GetString(self.handle)
+
     def __str__(self):
         return self.value
     
 # pulled from: https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L2029
 class ConstantStringValueHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.ConstantStringValue or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.ConstantStringValue
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetConstantStringValue(self, metadataReader):
-        return ConstantStringValue(metadataReader, self)
+        return metadataReader.GetRecord(ConstantStringValue, self)
             
     
 
@@ -476,18 +666,19 @@ class ConstantStringValueHandle(NativeFormatHandle):
 '''
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L5153
 class TypeReferenceHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.TypeReference or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.TypeReference
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetTypeReference(self, reader):
-        return TypeReference(reader, self)
+        return reader.GetRecord(TypeReference, self)
     
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L5130
 class TypeReference:
+    HANDLE_TYPE = HandleType.TypeReference
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -507,19 +698,20 @@ A type specification seems to specify
 '''
 
 class TypeSpecificationHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.TypeSpecification or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.TypeSpecification
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
 
     def GetTypeSpecification(self, reader):
-        return TypeSpecification(reader, self)
+        return reader.GetRecord(TypeSpecification, self)
 
 
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L5208
 class TypeSpecification:
+    HANDLE_TYPE = HandleType.TypeSpecification
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -563,19 +755,20 @@ TypeInstantiationSignature
 '''
 
 class TypeInstantiationSignatureHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.TypeInstantiationSignature or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.TypeInstantiationSignature
 
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetTypeInstantiationSignature(self, reader):
-        return TypeInstantiationSignature(reader, self)
+        return reader.GetRecord(TypeInstantiationSignature, self)
     
     
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L5041
 class TypeInstantiationSignature:
+    HANDLE_TYPE = HandleType.TypeInstantiationSignature
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -605,17 +798,18 @@ ModifiedType
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L3613
 
 class ModifiedTypeHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.ModifiedType or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.ModifiedType
     
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetModifiedType(self, reader):
-        return ModifiedType(reader, self)
+        return reader.GetRecord(ModifiedType, self)
 
 class ModifiedType:
+    HANDLE_TYPE = HandleType.ModifiedType
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -649,18 +843,19 @@ SZArraySignature
 
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4524C18-L4524C40
 class SZArraySignatureHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.SZArraySignature or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.SZArraySignature
     
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetSZArraySignature(self, reader):
-        return SZArraySignature(reader, self)
+        return reader.GetRecord(SZArraySignature, self)
 
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4501
 class SZArraySignature:
+    HANDLE_TYPE = HandleType.SZArraySignature
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -693,18 +888,19 @@ ArraySignature
 '''
 
 class ArraySignatureHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.ArraySignature or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.ArraySignature
     
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
     
     def GetArraySignature(self, reader):
-        return ArraySignature(reader, self)
+        return reader.GetRecord(ArraySignature, self)
     
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L27
 class ArraySignature:
+    HANDLE_TYPE = HandleType.ArraySignature
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -737,18 +933,19 @@ PointerSignatureHandle
 '''
 
 class PointerSignatureHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.PointerSignature or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.PointerSignature
     
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
 
     def GetPointerSignature(self, reader):
-        return PointerSignature(reader, self)
+        return reader.GetRecord(PointerSignature, self)
 
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4066
 class PointerSignature:
+    HANDLE_TYPE = HandleType.PointerSignature
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -780,18 +977,19 @@ ByReferenceSignature
 '''
 
 class ByReferenceSignatureHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.ByReferenceSignature or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.ByReferenceSignature
     
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
 
     def GetByReferenceSignature(self, reader):
-        return ByReferenceSignature(reader, self)
+        return reader.GetRecord(ByReferenceSignature, self)
 
 #https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L4066
 class ByReferenceSignature:
+    HANDLE_TYPE = HandleType.ByReferenceSignature
+
     def __init__(self, reader, handle):
         self.reader = reader
         self.handle = handle
@@ -830,13 +1028,20 @@ class MethodSignature:
 
 # pulled from: https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs#L3480
 class MethodSignatureHandle(NativeFormatHandle):
-    def __init__(self, value):
-        super().__init__(value)
-        assert self._hType == 0 or self._hType == HandleType.MethodSignature or self._hType == HandleType.Null
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.MethodSignature
     
     def Read(reader, offset):
         return NativeFormatHandle.Read(reader, offset, __class__)
 
+#https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderGen.cs
+class FieldSignatureHandle(NativeFormatHandle):
+    __slots__ = ()
+    HANDLE_TYPE = HandleType.FieldSignature
+
+    def Read(reader, offset):
+        return NativeFormatHandle.Read(reader, offset, __class__)
+
 
 '''
 ------Primitive Collections------
@@ -845,7 +1050,10 @@ These are output here: https://github.com/dotnet/runtime/blob/e133fe4f5311c0397f
 '''
     
 #The difference between this and a normal NativeCollection is that a NativePrimitiveCollection
+#The elements sit back to back right after the count. Byte sized elements (ELEMENT_TYPE.RAW) are stored as is, so those collections can be pulled out in one go with to_bytes/to_array/to_numpy instead of going element by element. Wider elements are varints, to_array/to_numpy decode them the same way the enumerator does
 class NativePrimitiveCollection:
+    ELEMENT_TYPE = None
+
     def __init__(self, reader, offset):
         self.reader = reader
         self.offset = offset
@@ -857,10 +1065,48 @@ class NativePrimitiveCollection:
         offset = offset + count * elem.SIZE
         return (offset, values)
 
+    def __len__(self):
+        (_, count) = self.reader.DecodeUnsigned(self.offset)
+        return count
+
+    #memoryview over the raw elements. This is a view into the metadata blob, nothing is copied unless the blob itself had to be read lazily
+    #Only element types that are stored as plain bytes (ELEMENT_TYPE.RAW) have raw elements, the wider ones are varints
+    def to_bytes(self):
+        if not self.ELEMENT_TYPE.RAW:
+            raise TypeError(f'{self.ELEMENT_TYPE.__name__} elements are stored as varints, use to_array', self.ELEMENT_TYPE)
+        (start, count) = self.reader.DecodeUnsigned(self.offset)
+        end = start + count
+        if count != 0:
+            self.reader.EnsureOffsetInRange(start, end - start - 1)
+        return memoryview(self.reader.buffer[start:end])
+
+    #the varint element types are decoded one after the other, exactly like the enumerator does
+    def to_array(self):
+        values = array(self.ELEMENT_TYPE.TYPECODE)
+        if self.ELEMENT_TYPE.RAW:
+            values.frombytes(self.to_bytes())
+            return values
+        (offset, count) = self.reader.DecodeUnsigned(self.offset)
+        read = self.ELEMENT_TYPE.Read
+        for i in range(count):
+            (offset, value) = read(self.reader, offset)
+            values.append(value)
+        return values
+
+    #numpy array of the elements, needs numpy. Read-only view over the blob for the RAW element types
+    def to_numpy(self):
+        if numpy is None:
+            raise ImportError('to_numpy needs numpy')
+        if self.ELEMENT_TYPE.RAW:
+            return numpy.frombuffer(self.to_bytes(), dtype=self.ELEMENT_TYPE.DTYPE)
+        return numpy.array(self.to_array(), dtype=self.ELEMENT_TYPE.DTYPE)
+
     #The enumerator is exactly the same between NativeFormatCollection and NativePrimitiveCollection
     #This is evidenced by the fact that you use the same method to emit stuff for Handle collections and primitive collections: https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/Generator/ReaderGen.cs#L48
     
 class CharCollection(NativePrimitiveCollection):
+    ELEMENT_TYPE = Char
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -872,6 +1118,8 @@ class CharCollection(NativePrimitiveCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, Char)
     
 class Int16Collection(NativePrimitiveCollection):
+    ELEMENT_TYPE = Int16
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -882,6 +1130,8 @@ class Int16Collection(NativePrimitiveCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, Int16)
     
 class SByteCollection(NativePrimitiveCollection):
+    ELEMENT_TYPE = SByte
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -893,6 +1143,8 @@ class SByteCollection(NativePrimitiveCollection):
 
 
 class UInt64Collection(NativePrimitiveCollection):
+    ELEMENT_TYPE = UInt64
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -903,6 +1155,8 @@ class UInt64Collection(NativePrimitiveCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, UInt64)
     
 class Int32Collection(NativePrimitiveCollection):
+    ELEMENT_TYPE = Int32
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -913,6 +1167,8 @@ class Int32Collection(NativePrimitiveCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, Int32)
     
 class UInt32Collection(NativePrimitiveCollection):
+    ELEMENT_TYPE = UInt32
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -923,6 +1179,8 @@ class UInt32Collection(NativePrimitiveCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, UInt32)
     
 class ByteCollection(NativePrimitiveCollection):
+    ELEMENT_TYPE = Byte
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -933,6 +1191,8 @@ class ByteCollection(NativePrimitiveCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, Byte)
 
 class UInt16Collection(NativePrimitiveCollection):
+    ELEMENT_TYPE = UInt16
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
@@ -943,6 +1203,8 @@ class UInt16Collection(NativePrimitiveCollection):
         return NativeFormatCollection.Enumerator(self.reader, self.offset, UInt16)
     
 class Int16Collection(NativePrimitiveCollection):
+    ELEMENT_TYPE = Int16
+
     def __init__(self, reader, offset):
         super().__init__(reader, offset)
         
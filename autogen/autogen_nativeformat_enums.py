@@ -1,4 +1,5 @@
-from binaryninja import *
+from enum import Flag
+from ..utils import *
 from ..nativeformat import *
 
 
@@ -81,6 +82,39 @@ class MethodImplAttributes(Flag):
         (offset, value) = reader.DecodeUnsigned(offset)
         return (offset, __class__(value))
     
+#https://github.com/dotnet/runtime/blob/main/src/libraries/System.Private.CoreLib/src/System/Reflection/FieldAttributes.cs
+class FieldAttributes(Flag):
+    # Member access mask
+    FieldAccessMask = 0x0007
+    PrivateScope = 0x0000    # Member not referenceable.
+    Private = 0x0001         # Accessible only by the parent type.
+    FamANDAssem = 0x0002     # Accessible by sub-types only in this Assembly.
+    Assembly = 0x0003        # Accessibly by anyone in the Assembly.
+    Family = 0x0004          # Accessible only by type and sub-types.
+    FamORAssem = 0x0005      # Accessibly by sub-types anywhere, plus anyone in assembly.
+    Public = 0x0006          # Accessibly by anyone who has visibility to this scope.
+
+    # Field contract attributes
+    Static = 0x0010          # Defined on type, else per instance.
+    InitOnly = 0x0020        # Field may only be initialized, not written to after init.
+    Literal = 0x0040         # Value is compile time constant.
+    NotSerialized = 0x0080   # Field does not have to be serialized when type is remoted.
+    SpecialName = 0x0200     # field is special. Name describes how.
+
+    # Interop attributes
+    PinvokeImpl = 0x2000     # Implementation is forwarded through pinvoke.
+
+    RTSpecialName = 0x0400   # Runtime(metadata internal APIs) should check name encoding.
+    HasFieldMarshal = 0x1000 # Field has marshalling information.
+    HasDefault = 0x8000      # Field has default.
+    HasFieldRVA = 0x0100     # Field has RVA.
+
+    ReservedMask = 0x9500
+
+    def Read(reader, offset):
+        (offset, value) = reader.DecodeUnsigned(offset)
+        return (offset, __class__(value))
+
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeFormatReaderCommonGen.cs#L22
 class AssemblyFlags(Flag):
     PublicKey = 0x1
@@ -109,12 +143,12 @@ class TypeAttributes(Flag):
     NestedFamANDAssem = 0x00000006
     NestedFamORAssem = 0x00000007
 
-    LayoutMask = 0x00000018,
+    LayoutMask = 0x00000018
     AutoLayout = 0x00000000
     SequentialLayout = 0x00000008
     ExplicitLayout = 0x00000010
 
-    ClassSemanticsMask = 0x00000020,
+    ClassSemanticsMask = 0x00000020
     Class = 0x00000000
     Interface = 0x00000020
 
@@ -125,7 +159,7 @@ class TypeAttributes(Flag):
     Serializable = 0x00002000
     WindowsRuntime = 0x00004000
 
-    StringFormatMask = 0x00030000,
+    StringFormatMask = 0x00030000
     AnsiClass = 0x00000000
     UnicodeClass = 0x00010000
     AutoClass = 0x00020000
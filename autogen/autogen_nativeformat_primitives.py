@@ -1,4 +1,3 @@
-from binaryninja import *
 from ..utils import *
 
 #The nativeformat reading for the primitives are generated manually here: https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/MdBinaryReader.cs
@@ -7,8 +6,14 @@ from ..utils import *
 
 #These are primitive wrappers so they don't return objects, instead they return the underlying primitive
 
+#SIZE is the width of the underlying C# type. TYPECODE (array module) and DTYPE (NumPy, little endian) describe the same element for the bulk reads in NativePrimitiveCollection
+#RAW is True for the types that are stored as plain bytes. Everything wider is stored as a varint, so a collection of them isn't SIZE bytes per element
+
 class Boolean:
     SIZE = 1
+    RAW = True
+    TYPECODE = 'B'
+    DTYPE = '<u1'
     def Read(reader, offset):
         value = reader.ReadUInt8(offset)
         return (offset+1, value == 1)
@@ -20,6 +25,9 @@ class String:
 
 class Char:
     SIZE = 1
+    RAW = True
+    TYPECODE = 'B'
+    DTYPE = '<u1'
     def Read(reader, offset):
         value = reader.ReadUInt8(offset)
         return (offset+1, value)
@@ -27,12 +35,18 @@ class Char:
 # AKA short
 class Int16:
     SIZE = 2
+    RAW = False
+    TYPECODE = 'h'
+    DTYPE = '<i2'
     def Read(reader, offset):
         (offset, value) = reader.DecodeSigned(offset)
         return (offset, s16(value))
 
 class SByte:
     SIZE = 1
+    RAW = True
+    TYPECODE = 'b'
+    DTYPE = '<i1'
     def Read(reader, offset):
         value = reader.ReadUInt8(offset)
         return (offset+1, s8(value))
@@ -40,6 +54,9 @@ class SByte:
 #AKA ulong
 class UInt64:
     SIZE = 8
+    RAW = False
+    TYPECODE = 'Q'
+    DTYPE = '<u8'
     def Read(reader, offset):
         (offset, value) = reader.DecodeUnsignedLong(offset)
         return (offset, u64(value))
@@ -47,6 +64,9 @@ class UInt64:
 #AKA int 
 class Int32:
     SIZE = 4
+    RAW = False
+    TYPECODE = 'i'
+    DTYPE = '<i4'
     def Read(reader, offset):
         (offset, value) = reader.DecodeSigned(offset)
         return (offset, s32(value))
@@ -54,12 +74,18 @@ class Int32:
 #AKA uint
 class UInt32:
     SIZE = 4
+    RAW = False
+    TYPECODE = 'I'
+    DTYPE = '<u4'
     def Read(reader, offset):
         (offset, value) = reader.DecodeUnsigned(offset)
         return (offset, u32(value))
 
 class Byte:
     SIZE = 1
+    RAW = True
+    TYPECODE = 'B'
+    DTYPE = '<u1'
     def Read(reader, offset):
         value = reader.ReadUInt8(offset)
         return (offset+1, value)
@@ -67,6 +93,9 @@ class Byte:
 #AKA ushort
 class UInt16:
     SIZE = 2
+    RAW = False
+    TYPECODE = 'H'
+    DTYPE = '<u2'
     def Read(reader, offset):
         (offset, value) = reader.DecodeUnsigned(offset)
         return (offset, u16(value))
@@ -74,6 +103,9 @@ class UInt16:
 #AKA long
 class Int64:
     SIZE = 8
+    RAW = False
+    TYPECODE = 'q'
+    DTYPE = '<i8'
     def Read(reader, offset):
         (offset, value) = reader.DecodeSignedLong(offset)
         return (offset, s64(value))
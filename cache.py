@@ -0,0 +1,163 @@
+from .utils import *
+from .method_parser import *
+from .stacktrace_parser import *
+from .session import *
+import hashlib
+import json
+import os
+import zlib
+
+'''
+On-disk cache of what doit decodes
+
+Decoding the metadata of a big binary takes a while and the result only depends on the bytes of the binary and on this parser. So the first time a binary is processed, the ReadyToRun sections and the decoded tables are written out to a cache file named after the sha256 of the binary and PARSER_VERSION. The next time the same binary is opened, load_cached_sections puts the sections back without searching for the ReadyToRun headers and the tables are loaded straight from the file.
+
+Only the tables that are asked for are decoded and stored. doit only needs 'stacktrace' (DEFAULT_TABLES), the exporter and console work can ask for more (ALL_TABLES). If the cache file is missing some of the tables that are asked for, only those are decoded and added to the file.
+
+The file is zlib compressed JSON:
+
+{
+    'parser_version': PARSER_VERSION,
+    'sha256': hex digest of the binary,
+    'tables': names of the tables in TABLES that were decoded,
+    'modules': [ #one per module, in session.modules order
+        {
+            'header': address of the ReadyToRun header (same as module.header),
+            'sections': ReadyToRun ModuleInfoRows (same as module.sections.rows),
+            'types': see method_parser.collect_type_definitions ('types' table),
+            'methods': see method_parser.collect_type_definitions ('types' table),
+            'typemap': see method_parser.collect_typemap,
+            'stacktrace': (pMethod, name) pairs, see stacktrace_parser.decode_stacktrace_symbols,
+            'invoke_entrypoints': see method_parser.collect_invokemap_entrypoints,
+        },
+    ],
+}
+
+A table is an empty list in a module that doesn't have the sections (or the metadata) for it. Offsets in types/methods/typemap/invoke_entrypoints are into the metadata blob of that module. Addresses are unique across modules, so merge_modules can simply concatenate e.g. the stack trace symbols of every module.
+
+JSON rather than pickle so that loading a cache file can never run code. Bump PARSER_VERSION whenever any of the above changes shape or meaning, old cache files are then simply ignored.
+'''
+
+PARSER_VERSION = 3
+CACHE_DIR_ENV = 'AOT_DOTNET_CACHE_DIR'
+HASH_CHUNK_SIZE = 0x100000
+
+def default_cache_dir():
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.expanduser('~'), '.cache', 'aot_dotnet')
+
+#sha256 of the file that was opened (not of the rehydrated view)
+def binary_hash(bv):
+    digest = hashlib.sha256()
+    if is_headless(bv):
+        digest.update(bv.mm)
+        return digest.hexdigest()
+    raw = bv.file.raw
+    for offset in range(raw.start, raw.end, HASH_CHUNK_SIZE):
+        digest.update(raw.read(offset, min(HASH_CHUNK_SIZE, raw.end - offset)))
+    return digest.hexdigest()
+
+def cache_path(digest, cache_dir=None):
+    return os.path.join(cache_dir or default_cache_dir(), f'{digest}.v{PARSER_VERSION}.json.z')
+
+#table -> the keys it fills in on every module
+TABLES = {
+    'types': ('types', 'methods'),
+    'typemap': ('typemap',),
+    'stacktrace': ('stacktrace',),
+    'invoke_entrypoints': ('invoke_entrypoints',),
+}
+DEFAULT_TABLES = ('stacktrace',) #all that doit applies
+ALL_TABLES = tuple(TABLES)
+
+#runs the decoder of a single table on a single module. A module without metadata gets empty lists
+def decode_table(module, table, workers=None):
+    if module.metadata_reader is None:
+        return {key: [] for key in TABLES[table]}
+    match table:
+        case 'types':
+            (types, methods) = collect_type_definitions(module)
+            return {'types': types, 'methods': methods}
+        case 'typemap':
+            return {'typemap': collect_typemap(module, workers)}
+        case 'stacktrace':
+            return {'stacktrace': decode_stacktrace_symbols(module)}
+        case 'invoke_entrypoints':
+            return {'invoke_entrypoints': collect_invokemap_entrypoints(module, workers)}
+    raise ValueError(f'Unknown cache table {table}')
+
+#adds tables to the cache contents of a single module (a new one if entry is None)
+def build_module_cache(module, tables, workers=None, entry=None):
+    if entry is None:
+        entry = {'header': module.header, 'sections': module.sections.rows}
+    for table in tables:
+        entry.update(decode_table(module, table, workers))
+    return entry
+
+#decodes the tables that aren't in data yet (everything if data is None) on every module and returns the cache contents. Needs populate_sections and create_metadata_reader to have been run on every module
+def build_cache(session, digest, workers=None, tables=DEFAULT_TABLES, data=None):
+    if data is None:
+        data = {'parser_version': PARSER_VERSION, 'sha256': digest, 'tables': [], 'modules': [None] * len(session.modules)}
+    missing = [table for table in tables if table not in data['tables']]
+    data['modules'] = [build_module_cache(module, missing, workers, entry) for (module, entry) in zip(session.modules, data['modules'])]
+    data['tables'] = data['tables'] + missing
+    return data
+
+def has_tables(data, tables):
+    return all(table in data['tables'] for table in tables)
+
+#the cache contents of a single module, empty if there is no cache
+def module_cache(module):
+    if module.cache is None:
+        return dict()
+    return module.cache['modules'][module.module_index]
+
+#key (e.g. 'stacktrace') of every module concatenated
+def merge_modules(data, key):
+    return [item for module in data['modules'] for item in module[key]]
+
+#returns the cache contents or None if there is no usable cache file
+def load_cache(digest, cache_dir=None):
+    path = cache_path(digest, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            data = json.loads(zlib.decompress(f.read()))
+    except (OSError, ValueError, zlib.error):
+        return None
+    if data.get('parser_version') != PARSER_VERSION or data.get('sha256') != digest:
+        return None
+    return data
+
+def save_cache(data, cache_dir=None):
+    path = cache_path(data['sha256'], cache_dir)
+    return write_file_atomic(path, zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8')))
+
+#restores the sections of every module from the cache file, so populate_sections (and its search for the ReadyToRun headers) can be skipped. Returns (digest, cache contents), the contents are None (and nothing is restored) if there is no usable cache file
+#pass both on to load_or_build_cache, it then neither hashes the binary nor reads the file again
+def load_cached_sections(session, cache_dir=None):
+    digest = binary_hash(session.bv)
+    data = load_cache(digest, cache_dir)
+    if data is None:
+        return (digest, None)
+    restore_sections(session, [(module['header'], module['sections']) for module in data['modules']])
+    print('Restored the sections of', len(data['modules']), 'modules from', cache_path(digest, cache_dir))
+    return (digest, data)
+
+#fills in cache on every module, either from the cache file or by decoding the tables the file doesn't have (and then writing the cache file)
+#digest and data are what load_cached_sections returned, if it was run. Without digest the binary is hashed and the cache file is read here
+def load_or_build_cache(session, cache_dir=None, workers=None, tables=DEFAULT_TABLES, digest=None, data=None):
+    if digest is None:
+        digest = binary_hash(session.bv)
+        data = load_cache(digest, cache_dir)
+    if data is not None and len(data['modules']) != len(session.modules):
+        data = None #found a different set of modules than whoever wrote the cache
+    if data is not None and has_tables(data, tables):
+        print('Loaded metadata cache', cache_path(digest, cache_dir))
+    else:
+        data = build_cache(session, digest, workers, tables, data)
+        try:
+            print('Wrote metadata cache', save_cache(data, cache_dir))
+        except OSError as e:
+            print('Could not write metadata cache', e)
+    for module in session.modules:
+        module.cache = data
+    return data
@@ -130,6 +130,11 @@ class HandleType(IntEnum):
     TypeReference = 0x3d
     TypeSpecification = 0x3e
     TypeVariableSignature = 0x3f  
+
+#raw handle type byte -> HandleType, so decoding a handle is a list index instead of an enum construction. Bytes that aren't a handle type map to None
+HANDLE_TYPES = [None] * 0x100
+for _handle_type in HandleType:
+    HANDLE_TYPES[_handle_type.value] = _handle_type
     
 
 class StackTraceDataCommand(Flag):
@@ -0,0 +1,186 @@
+import mmap
+import os
+import struct
+
+'''
+A tiny stand-in for a Binary Ninja BinaryView so the parsers can run in plain CPython
+
+PEImage memory maps a PE file and maps virtual addresses onto file offsets using the section headers. It only implements the parts of the BinaryView API that the non-annotation parts of doit use:
+
+sections, start, end, read(), reader(), get_sections_at() and memory_map.add_memory_region()/remove_memory_region()
+
+Addresses are virtual addresses at the preferred ImageBase, which is what the (unrelocated) pointers in the ReadyToRun header already are.
+'''
+
+#https://learn.microsoft.com/en-us/windows/win32/debug/pe-format
+PE_SIGNATURE = b'PE\x00\x00'
+PE32_MAGIC = 0x10b
+PE32_PLUS_MAGIC = 0x20b
+SECTION_HEADER_SIZE = 40
+
+class PESection:
+    def __init__(self, name, start, virtual_size, raw_offset, raw_size):
+        self.name = name
+        self.start = start
+        self.end = start + virtual_size
+        self.raw_offset = raw_offset
+        self.raw_size = raw_size
+
+    def __len__(self):
+        return self.end - self.start
+
+#equivalent of bv.memory_map. Every region is just a buffer that shadows whatever was at that address in the file
+class PEMemoryMap:
+    def __init__(self):
+        self.regions = dict() #name -> (start, bytearray)
+
+    #data is the contents of the region or the path of a file holding them, which gets memory mapped like Binary Ninja does
+    def add_memory_region(self, name, start, data):
+        if name in self.regions:
+            return False
+        if isinstance(data, (str, os.PathLike)):
+            with open(data, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.regions[name] = (start, bytes(data) if isinstance(data, (bytearray, memoryview)) else data)
+        return True
+
+    def remove_memory_region(self, name):
+        return self.regions.pop(name, None) is not None
+
+    #unmaps the regions that were memory mapped from a file
+    def close(self):
+        for (start, data) in self.regions.values():
+            if isinstance(data, mmap.mmap):
+                close_mapping(data)
+        self.regions.clear()
+
+    def region_at(self, address):
+        for (start, data) in self.regions.values():
+            if start <= address < start + len(data):
+                return (start, data)
+        return None
+
+#A mapping can't be closed while something still has a memoryview into it (a record or reader the caller kept around). It is then unmapped as soon as the last of those views goes away instead
+def close_mapping(mm):
+    try:
+        mm.close()
+    except BufferError:
+        pass
+
+#Holds an open file and a mapping of it, so call close() (or use it in a with block) once done with it. AotSession.close() does this for the image it wraps
+class PEImage:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.memory_map = PEMemoryMap()
+
+        e_lfanew = struct.unpack_from('<I', self.mm, 0x3c)[0]
+        if self.mm[e_lfanew:e_lfanew+4] != PE_SIGNATURE:
+            raise ValueError('Not a PE file', path)
+        (number_of_sections, size_of_optional_header) = struct.unpack_from('<2xH12xH', self.mm, e_lfanew + 4)
+        optional_header = e_lfanew + 24
+        magic = struct.unpack_from('<H', self.mm, optional_header)[0]
+        if magic == PE32_PLUS_MAGIC:
+            self.address_size = 8
+            self.image_base = struct.unpack_from('<Q', self.mm, optional_header + 24)[0]
+        elif magic == PE32_MAGIC:
+            self.address_size = 4
+            self.image_base = struct.unpack_from('<I', self.mm, optional_header + 28)[0]
+        else:
+            raise ValueError('Bad optional header magic', hex(magic))
+        (size_of_image, size_of_headers) = struct.unpack_from('<II', self.mm, optional_header + 56)
+        self.size_of_headers = size_of_headers
+        self.start = self.image_base
+        self.end = self.image_base + size_of_image
+
+        self.sections = dict()
+        section_header = optional_header + size_of_optional_header
+        for i in range(number_of_sections):
+            (raw_name, virtual_size, virtual_address, raw_size, raw_offset) = struct.unpack_from('<8sIIII', self.mm, section_header + i*SECTION_HEADER_SIZE)
+            name = raw_name.rstrip(b'\x00').decode('utf-8', 'replace')
+            self.sections[name] = PESection(name, self.image_base + virtual_address, virtual_size or raw_size, raw_offset, raw_size)
+
+    def close(self):
+        self.memory_map.close()
+        if self.mm is not None:
+            close_mapping(self.mm)
+            self.mm = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_sections_at(self, address):
+        return [section for section in self.sections.values() if section.start <= address < section.end]
+
+    #returns (file offset, number of bytes that are backed by the file from there, number of bytes in the section from there)
+    def _locate(self, address):
+        for section in self.sections.values():
+            if section.start <= address < section.end:
+                off = address - section.start
+                return (section.raw_offset + off, max(section.raw_size - off, 0), section.end - address)
+        if self.start <= address < self.start + self.size_of_headers:
+            off = address - self.start
+            return (off, self.size_of_headers - off, self.size_of_headers - off)
+        return None
+
+    #Reads never span a section. Bytes past the raw data of a section (uninitialized data) read as zero, like they would once mapped
+    def read(self, address, length):
+        region = self.memory_map.region_at(address)
+        if region is not None:
+            (start, data) = region
+            return memoryview(data)[address-start:address-start+length]
+        location = self._locate(address)
+        if location is None:
+            return b''
+        (file_offset, backed, available) = location
+        length = min(length, available)
+        if length <= backed:
+            return memoryview(self.mm)[file_offset:file_offset+length]
+        return bytes(self.mm[file_offset:file_offset+backed]) + b'\x00'*(length - backed)
+
+    def reader(self, address=0):
+        return PEReader(self, address)
+
+#same shape as binaryninja.BinaryReader
+class PEReader:
+    def __init__(self, image, address):
+        self.image = image
+        self.offset = address
+
+    def seek(self, address):
+        self.offset = address
+
+    def seek_relative(self, offset):
+        self.offset += offset
+
+    def read(self, length, address=None):
+        if address is not None:
+            self.offset = address
+        data = self.image.read(self.offset, length)
+        if len(data) != length:
+            return None
+        self.offset += length
+        return data
+
+    def _unpack(self, fmt, size, address):
+        data = self.read(size, address)
+        if data is None:
+            return None
+        return struct.unpack(fmt, data)[0]
+
+    def read8(self, address=None):
+        return self._unpack('<B', 1, address)
+
+    def read16(self, address=None):
+        return self._unpack('<H', 2, address)
+
+    def read32(self, address=None):
+        return self._unpack('<I', 4, address)
+
+    def read64(self, address=None):
+        return self._unpack('<Q', 8, address)
@@ -1,32 +1,52 @@
-from binaryninja import *
+from .utils import *
 from .dotnet_enums import *
 from .nativeformat import *
 from .rtr import *
 from .autogen.autogen_nativeformat import *
 from .misc import *
 
-#this comes from here: https://github.com/dotnet/runtime/blob/c43fc8966036678d8d603bdfbd1afd79f45b420b/src/coreclr/nativeaot/System.Private.Reflection.Execution/src/Internal/Reflection/Execution/ExecutionEnvironmentImplementation.MappingTables.cs#L643
-def parse_invokemap(invokeMapStart, invokeMapEnd):
-    reader = NativeReader(invokeMapStart, invokeMapEnd-invokeMapStart) #create a NativeReader starting from end-start
-    enumerator = NativeHashTable.AllEntriesEnumerator(NativeHashTable(NativeParser(reader, 0))) 
+#Entry decoders. They only look at the entry itself and return plain values, so they can also run in the worker processes of NativeHashTable.EnumerateParallel
+
+#returns (flags, method handle or name and sig, declaring type index, entrypoint index), or None for entries without an entrypoint
+def decode_invokemap_entry(entryParser):
+    entryFlags = entryParser.GetUnsigned()
     
-    #entryParser = enumerator.GetNext()
-    externalReferences = ExternalReferencesTable(ReflectionMapBlob.CommonFixupsTable)
-    for entryParser in enumerator: 
-        entryFlags = entryParser.GetUnsigned()
+    if entryFlags & InvokeTableFlags.HasEntrypoint == 0: #its only a method if it has entrypoint
+        return None
         
-        if entryFlags & InvokeTableFlags.HasEntrypoint == 0: #its only a method if it has entrypoint
+    entryMethodHandleOrNameAndSigRaw = entryParser.GetUnsigned()
+    entryDeclaringTypeRaw = entryParser.GetUnsigned()
+    entryMethodEntryPointRaw = entryParser.GetUnsigned()
+    return (entryFlags, entryMethodHandleOrNameAndSigRaw, entryDeclaringTypeRaw, entryMethodEntryPointRaw)
+
+#returns (MethodTable index, metadata handle)
+def decode_typemap_entry(entryParser):
+    idx = entryParser.GetUnsigned()
+    hVal = entryParser.GetUnsigned()
+    return (idx, hVal)
+
+#decode every entry of table, either serially or sharded across workers processes
+def decode_all_entries(table, decoder, workers=None):
+    if workers:
+        return table.EnumerateParallel(decoder, workers)
+    return table.DecodeEntries(decoder)
+
+#this comes from here: https://github.com/dotnet/runtime/blob/c43fc8966036678d8d603bdfbd1afd79f45b420b/src/coreclr/nativeaot/System.Private.Reflection.Execution/src/Internal/Reflection/Execution/ExecutionEnvironmentImplementation.MappingTables.cs#L643
+def parse_invokemap(session, invokeMapStart, invokeMapEnd, workers=None):
+    reader = NativeReader(session, invokeMapStart, invokeMapEnd-invokeMapStart) #create a NativeReader starting from end-start
+    entries = decode_all_entries(NativeHashTable(NativeParser(reader, 0)), decode_invokemap_entry, workers)
+    
+    externalReferences = get_external_references(session, ReflectionMapBlob.CommonFixupsTable)
+    executionEnvironment = ExecutionEnvironmentImplementation(session)
+    metadataReader = session.metadata_reader
+    for entry in entries: 
+        if entry is None:
             continue
-            
-        entryMethodHandleOrNameAndSigRaw = entryParser.GetUnsigned()
-        entryDeclaringTypeRaw = entryParser.GetUnsigned()
+        (entryFlags, entryMethodHandleOrNameAndSigRaw, entryDeclaringTypeRaw, entryMethodEntryPointRaw) = entry
 
-        entryMethodEntryPoint = externalReferences.GetFunctionPointerFromIndex(entryParser.GetUnsigned())
+        entryMethodEntryPoint = externalReferences.GetFunctionPointerFromIndex(entryMethodEntryPointRaw)
         print('entryMethodEntryPoint', hex(entryMethodEntryPoint))
 
-        if entryFlags & InvokeTableFlags.NeedsParameterInterpretation == 0:
-            entryParser.SkipInteger()
-
         if entryFlags & InvokeTableFlags.RequiresInstArg == 0:
             declaringTypeHandle = externalReferences.GetRuntimeTypeHandleFromIndex(entryDeclaringTypeRaw)
         else:
@@ -35,17 +55,17 @@ def parse_invokemap(invokeMapStart, invokeMapEnd):
         print('declaringTypeHandle', declaringTypeHandle)
         
         if entryFlags & int(InvokeTableFlags.HasMetadataHandle) != 0:
-            declaringTypeHandleDefinition = ExecutionEnvironmentImplementation.GetTypeDefinition(declaringTypeHandle)
+            declaringTypeHandleDefinition = executionEnvironment.GetTypeDefinition(declaringTypeHandle)
             if declaringTypeHandle != declaringTypeHandleDefinition:
                 print('declaringTypeHandleDefinition', declaringTypeHandleDefinition)
-            qTypeDefinition = ExecutionEnvironmentImplementation.GetMetadataForNamedType(declaringTypeHandleDefinition)
+            qTypeDefinition = executionEnvironment.GetMetadataForNamedType(declaringTypeHandleDefinition)
             nativeFormatMethodHandle = MethodHandle((HandleType.Method << 24) | entryMethodHandleOrNameAndSigRaw)
             methodHandle = QMethodDefinition(qTypeDefinition.NativeFormatReader, nativeFormatMethodHandle)
-            method = methodHandle.handle.GetMethod(METADATA_READER())
-            print('name', method.name.GetConstantStringValue(METADATA_READER()))
+            method = methodHandle.handle.GetMethod(metadataReader)
+            print('name', method.name.GetConstantStringValue(metadataReader))
 
-def get_all_methods():
-    metadata_reader = METADATA_READER()
+def get_all_methods(session):
+    metadata_reader = session.metadata_reader
     scope_definitions = metadata_reader.header.SCOPE_DEFINITIONS
     bfs = list() #list of namespace definition handles
     
@@ -79,19 +99,14 @@ def get_all_methods():
         for ns_def_handle in ns_def.namespaceDefinitions.GetEnumerator():
             bfs.append(ns_def_handle)
 
-def get_all_types():
-    metadata_reader = METADATA_READER()
-    (typeMapStart, typeMapEnd) = find_section_start_end(ReflectionMapBlob.TypeMap)
-    typeMapReader = NativeReader(typeMapStart, typeMapEnd-typeMapStart)
-    typeMapParser = NativeParser(typeMapReader, 0)
-    typeMapHashtable = NativeHashTable(typeMapParser)
-    externalReferences = ExternalReferencesTable(ReflectionMapBlob.CommonFixupsTable)
-    enumerator = NativeHashTable.AllEntriesEnumerator(typeMapHashtable) 
-    for entryParser in enumerator:
-        idx = entryParser.GetUnsigned()
+def get_all_types(session, workers=None):
+    metadata_reader = session.metadata_reader
+    typeMapHashtable = get_hashtable(session, ReflectionMapBlob.TypeMap)
+    externalReferences = get_external_references(session, ReflectionMapBlob.CommonFixupsTable)
+    metadata_reader.PredecodeNames() #the type map is in hash order, so the names would otherwise be decoded all over the blob
+    for (idx, hVal) in decode_all_entries(typeMapHashtable, decode_typemap_entry, workers):
         typeHandle = externalReferences.GetRuntimeTypeHandleFromIndex(idx)
         print('MethodTable', typeHandle)
-        hVal = entryParser.GetUnsigned()
         entryMetadataHandle = Handle(hVal)
         if entryMetadataHandle.hType == HandleType.TypeDefinition:
             typedef_handle = TypeDefinitionHandle(hVal)
@@ -109,8 +124,73 @@ def get_all_types():
         
 
 
-def brute_force(offset, HandleType):
-    metadata_reader = METADATA_READER()
+#Collectors. Same walks as above but they hand back plain tuples instead of printing (these are what cache.py stores)
+
+#returns (types, methods)
+#types is [(TypeDefinition offset, namespace, name, enclosing TypeDefinition offset or 0)]
+#methods is [(Method offset, owning TypeDefinition offset, name)]
+def collect_type_definitions(session):
+    metadata_reader = session.metadata_reader
+    types = list()
+    methods = list()
+
+    def walk_type(type_def_handle, namespace, enclosing):
+        type_def = type_def_handle.GetTypeDefinition(metadata_reader)
+        types.append((type_def_handle.Offset, namespace, str(type_def.get_name(metadata_reader)), enclosing))
+        for method_handle in type_def.methods:
+            method = method_handle.GetMethod(metadata_reader)
+            methods.append((method_handle.Offset, type_def_handle.Offset, str(method.name.GetConstantStringValue(metadata_reader))))
+        for nested_type_handle in type_def.nestedTypes:
+            walk_type(nested_type_handle, namespace, type_def_handle.Offset)
+
+    def walk_namespace(ns_def_handle, parent):
+        ns_def = ns_def_handle.GetNamespaceDefinition(metadata_reader)
+        name = '' if ns_def.name.IsNull() else str(ns_def.name.GetConstantStringValue(metadata_reader))
+        namespace = '.'.join(part for part in (parent, name) if part)
+        for type_def_handle in ns_def.typeDefinitions:
+            walk_type(type_def_handle, namespace, 0)
+        for child in ns_def.namespaceDefinitions:
+            walk_namespace(child, namespace)
+
+    for scope_definition_handle in metadata_reader.header.SCOPE_DEFINITIONS:
+        walk_namespace(scope_definition_handle.GetScopeDefinition(metadata_reader).rootNamespaceDefinition, '')
+    return (types, methods)
+
+#returns [(MethodTable address, TypeDefinition offset)] for every TypeMap entry that points at a TypeDefinition, [] if the binary has no type map
+def collect_typemap(session, workers=None):
+    if ReflectionMapBlob.TypeMap not in session.sections or ReflectionMapBlob.CommonFixupsTable not in session.sections:
+        return []
+    typeMapHashtable = get_hashtable(session, ReflectionMapBlob.TypeMap)
+    externalReferences = get_external_references(session, ReflectionMapBlob.CommonFixupsTable)
+    typemap = list()
+    for (idx, hVal) in decode_all_entries(typeMapHashtable, decode_typemap_entry, workers):
+        entryMetadataHandle = Handle(hVal)
+        if entryMetadataHandle.hType == HandleType.TypeDefinition:
+            typemap.append((externalReferences.GetRuntimeTypeHandleFromIndex(idx).val, entryMetadataHandle.Offset))
+    return typemap
+
+#returns [(entrypoint, declaring MethodTable address or None, Method offset or None)] for every invoke map entry with an entrypoint, [] if the binary has no invoke map
+def collect_invokemap_entrypoints(session, workers=None):
+    if ReflectionMapBlob.InvokeMap not in session.sections or ReflectionMapBlob.CommonFixupsTable not in session.sections:
+        return []
+    invokeMapHashtable = get_hashtable(session, ReflectionMapBlob.InvokeMap)
+    externalReferences = get_external_references(session, ReflectionMapBlob.CommonFixupsTable)
+    entrypoints = list()
+    for entry in decode_all_entries(invokeMapHashtable, decode_invokemap_entry, workers):
+        if entry is None:
+            continue
+        (entryFlags, entryMethodHandleOrNameAndSigRaw, entryDeclaringTypeRaw, entryMethodEntryPointRaw) = entry
+        declaringType = None
+        method = None
+        if entryFlags & InvokeTableFlags.RequiresInstArg == 0:
+            declaringType = externalReferences.GetRuntimeTypeHandleFromIndex(entryDeclaringTypeRaw).val
+        if entryFlags & int(InvokeTableFlags.HasMetadataHandle) != 0:
+            method = MethodHandle((HandleType.Method << 24) | entryMethodHandleOrNameAndSigRaw).Offset
+        entrypoints.append((externalReferences.GetFunctionPointerFromIndex(entryMethodEntryPointRaw), declaringType, method))
+    return entrypoints
+
+def brute_force(session, offset, HandleType):
+    metadata_reader = session.metadata_reader
     streamReader = metadata_reader.streamReader
     endOffset = streamReader.size
     for i in range(endOffset): #check every possible offset for our target value
@@ -123,13 +203,13 @@ def brute_force(offset, HandleType):
             print('address', hex(streamReader.base + i))
     print('Could find the offset')
 
-def parse_methods():
-    create_metadata_reader()
-    (start,end) = find_section_start_end(ReflectionMapBlob.InvokeMap)
-    parse_invokemap(start, end)
-    #get_all_methods()
-    #get_all_types()
-    #brute_force(0xc9b3, ConstantStringValueHandle)
+def parse_methods(session, workers=None):
+    create_metadata_reader(session)
+    (start,end) = find_section_start_end(session, ReflectionMapBlob.InvokeMap)
+    parse_invokemap(session, start, end, workers)
+    #get_all_methods(session)
+    #get_all_types(session)
+    #brute_force(session, 0xc9b3, ConstantStringValueHandle)
 
 
 
@@ -1,4 +1,3 @@
-from binaryninja import *
 from .nativeformat import *
 from .utils import *
 from .rtr import *
@@ -18,10 +17,12 @@ NUM_INTERFACES_OFF = 0x12
 
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/nativeaot/Common/src/Internal/Runtime/TypeLoader/ExternalReferencesTable.cs#L15
 class ExternalReferencesTable:
-    def __init__(self, section_id):
-        (start, end) = find_section_start_end(section_id)
+    def __init__(self, session, section_id):
+        (start, end) = find_section_start_end(session, section_id)
+        self.session = session
         self.elements = start
         self.elementsCount = (end-start)//4
+        self.reader = get_section_reader(session, section_id)
     def GetIntPtrFromIndex(self, idx):
         return self.GetAddressFromIndex(idx)
 
@@ -29,7 +30,7 @@ class ExternalReferencesTable:
         return self.GetAddressFromIndex(idx)
     
     def GetRuntimeTypeHandleFromIndex(self, idx):
-        return RuntimeAugments.CreateRuntimeTypeHandle(self.GetIntPtrFromIndex(idx))
+        return RuntimeAugments.CreateRuntimeTypeHandle(self.session, self.GetIntPtrFromIndex(idx))
     
     def GetAddressFromIndex(self, idx):
         #in this case, we use the relative pointer version
@@ -37,19 +38,26 @@ class ExternalReferencesTable:
             raise ValueError('Bad Image Format Exception')
         
         pRelPtr32 = self.elements + idx*4
-        return pRelPtr32 + s64(s32(read32(pRelPtr32))) 
+        return pRelPtr32 + s64(s32(self.reader.ReadUInt32(idx*4)))
+
+#ExternalReferencesTables never change once the sections are known, so there is one per section per session
+def get_external_references(session, section_id):
+    return session.sections.get('external_references', section_id, lambda start, end: ExternalReferencesTable(session, section_id))
 
 #https://github.com/dotnet/runtime/blob/main/src/coreclr/nativeaot/System.Private.CoreLib/src/Internal/Runtime/Augments/RuntimeAugments.cs#L37
 class RuntimeAugments:
-    def CreateRuntimeTypeHandle(ldTokenResult):
-        return RuntimeTypeHandle(ldTokenResult)
+    def CreateRuntimeTypeHandle(session, ldTokenResult):
+        return RuntimeTypeHandle(session, ldTokenResult)
     
     def IsGenericType(typeHandle):
-        m_uFlags = u32(read32(typeHandle.val))
+        m_uFlags = u32(typeHandle.session.read32(typeHandle.val))
         return m_uFlags & IS_GENERIC_FLAG != 0
 
     # pulled from assembly and https://github.com/dotnet/runtime/blob/6d23ef4d68bbcdb38fdc22218d1073c5083ac6a1/src/coreclr/nativeaot/Common/src/Internal/Runtime/MethodTable.cs#L457
     def GetGenericDefinition(typeHandle):
+        session = typeHandle.session
+        read16 = session.read16
+        read32 = session.read32
         flags = u32(read32(typeHandle.val))
 
         if (flags & 0x80000) == 0:
@@ -68,9 +76,9 @@ class RuntimeAugments:
             b = read32(n)
 
             if (u32(b) & 1) != 0:
-                return RuntimeTypeHandle(read32(n + s32(b & 0xfffffffe)))
+                return RuntimeTypeHandle(session, read32(n + s32(b & 0xfffffffe)))
 
-            return RuntimeTypeHandle(n + s32(b))
+            return RuntimeTypeHandle(session, n + s32(b))
 
         off = (read16(typeHandle.val + NUM_INTERFACES_OFF) << 3) + (read16(typeHandle.val + NUM_VTABLE_SLOTS_OFF) << 3) + 0x28
 
@@ -87,37 +95,39 @@ class RuntimeAugments:
         b = read32(n)
 
         if (u32(b) & 1) != 0:
-            return RuntimeTypeHandle(read32(b - 1))
+            return RuntimeTypeHandle(session, read32(b - 1))
 
-        return RuntimeTypeHandle(b)
+        return RuntimeTypeHandle(session, b)
 
 #https://github.com/dotnet/runtime/blob/86d2eaa16d818149c1c2869bf0234c6eba24afac/src/coreclr/nativeaot/System.Private.Reflection.Execution/src/Internal/Reflection/Execution/ExecutionEnvironmentImplementation.MappingTables.cs#L35
 class ExecutionEnvironmentImplementation:
-    def GetMetadataForNamedType(runtimeTypeHandle):
-        (is_val, qTypeDefinition) = TypeLoaderEnvironment.TryGetMetadataForNamedType(runtimeTypeHandle)
+    def __init__(self, session):
+        self.session = session
+        self.typeLoaderEnvironment = TypeLoaderEnvironment(session)
+
+    def GetMetadataForNamedType(self, runtimeTypeHandle):
+        (is_val, qTypeDefinition) = self.typeLoaderEnvironment.TryGetMetadataForNamedType(runtimeTypeHandle)
         if not is_val:
             raise ValueError('Invalid Operation Exception')
         return qTypeDefinition
         
-    def GetTypeDefinition(typeHandle):
+    def GetTypeDefinition(self, typeHandle):
         if (RuntimeAugments.IsGenericType(typeHandle)):
             return RuntimeAugments.GetGenericDefinition(typeHandle)
         return typeHandle
 
 # pulled from: https://github.com/dotnet/runtime/blob/86d2eaa16d818149c1c2869bf0234c6eba24afac/src/coreclr/nativeaot/System.Private.TypeLoader/src/Internal/Runtime/TypeLoader/TypeLoaderEnvironment.Metadata.cs#L55
 class TypeLoaderEnvironment:
-    def __init__(self):
-        pass
+    def __init__(self, session):
+        self.session = session
 
-    def TryGetMetadataForNamedType(runtimeTypeHandle): # return QTypeDefinition
+    def TryGetMetadataForNamedType(self, runtimeTypeHandle): # return QTypeDefinition
         #note we only use the current module
+        session = self.session
         hashcode = runtimeTypeHandle.GetHashCode()
         #print('hashcode', hex(hashcode))
-        (typeMapStart, typeMapEnd) = find_section_start_end(ReflectionMapBlob.TypeMap)
-        typeMapReader = NativeReader(typeMapStart, typeMapEnd-typeMapStart)
-        typeMapParser = NativeParser(typeMapReader, 0)
-        typeMapHashtable = NativeHashTable(typeMapParser)
-        externalReferences = ExternalReferencesTable(ReflectionMapBlob.CommonFixupsTable)
+        typeMapHashtable = get_hashtable(session, ReflectionMapBlob.TypeMap, materialize=True) #this gets hit once per invoke map entry
+        externalReferences = get_external_references(session, ReflectionMapBlob.CommonFixupsTable)
         
         lookup = typeMapHashtable.Lookup(hashcode)
         
@@ -127,6 +137,28 @@ class TypeLoaderEnvironment:
             if foundType == runtimeTypeHandle:
                 entryMetadataHandle = Handle(entryParser.GetUnsigned())
                 if entryMetadataHandle.hType == HandleType.TypeDefinition:
-                    metadataReader = METADATA_READER()
+                    metadataReader = session.metadata_reader
                     return (True, QTypeDefinition(metadataReader, entryMetadataHandle))
-        return (False, None)
\ No newline at end of file
+        return (False, None)
+
+    #TryGetMetadataForNamedType for a batch of RuntimeTypeHandles with a single LookupMany on the TypeMap
+    #returns a dict of MethodTable address -> QTypeDefinition, or None where there is no metadata
+    def TryGetMetadataForNamedTypes(self, runtimeTypeHandles):
+        session = self.session
+        runtimeTypeHandles = list(runtimeTypeHandles)
+        typeMapHashtable = get_hashtable(session, ReflectionMapBlob.TypeMap)
+        externalReferences = get_external_references(session, ReflectionMapBlob.CommonFixupsTable)
+
+        lookups = typeMapHashtable.LookupMany(runtimeTypeHandle.GetHashCode() for runtimeTypeHandle in runtimeTypeHandles)
+        results = dict()
+        for runtimeTypeHandle in runtimeTypeHandles:
+            results[runtimeTypeHandle.val] = None
+            for entryParser in lookups[u32(runtimeTypeHandle.GetHashCode())]:
+                idx = entryParser.GetUnsigned()
+                foundType = externalReferences.GetRuntimeTypeHandleFromIndex(idx)
+                if foundType == runtimeTypeHandle:
+                    entryMetadataHandle = Handle(entryParser.GetUnsigned())
+                    if entryMetadataHandle.hType == HandleType.TypeDefinition:
+                        results[runtimeTypeHandle.val] = QTypeDefinition(session.metadata_reader, entryMetadataHandle)
+                        break
+        return results
@@ -1,8 +1,14 @@
-from binaryninja import *
 from .utils import *
 from .rtr import *
 from .dotnet_enums import *
 from .autogen.autogen_nativeformat import *
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from collections import OrderedDict
+import itertools
+import os
+import sys
 
 '''
 This file constitutes all the native format parsers
@@ -10,16 +16,17 @@ This file constitutes all the native format parsers
 This includes objects such as NativeReader, NativeParser, and, most importantly, NativeHashtable
 '''
 
-METADATA_READER = None
-
-
-
 #pulled from: https://github.com/dotnet/runtime/blob/cca022b6212f33adc982630ab91469882250256c/src/coreclr/tools/Common/Internal/NativeFormat/NativeFormatReader.cs#L217
 #This also integrates the functionality of NativePrimitiveDecoder: https://github.com/dotnet/runtime/blob/cca022b6212f33adc982630ab91469882250256c/src/coreclr/tools/Common/Internal/NativeFormat/NativeFormatReader.Primitives.cs#L16C36-L16C58
+#The whole blob is pulled into self.buffer once (see AotSession.load_buffer) and everything is decoded out of that. If the blob can't be read in one go, self.buffer is a LazyBuffer that falls back to the session's reader
+#A buffer that is already in memory (e.g. shared memory in a worker process) can be passed in directly, in which case session may be None
 class NativeReader:
-    def __init__(self, base, size):
+    def __init__(self, session, base, size, buffer=None):
+        self.session = session
         self.base = base
         self.size = size
+        self.buffer = buffer if buffer is not None else session.load_buffer(base, size)
+        self.varint_index = None #see BuildVarintIndex
     
     def EnsureOffsetInRange(self, offset, lookAhead):
         if(s32(offset) < 0 or (offset + lookAhead) >= self.size):
@@ -27,72 +34,84 @@ class NativeReader:
     
     def ReadUInt8(self, offset):
         self.EnsureOffsetInRange(offset, 0)
-        return read8(self.base + offset)
+        return self.buffer[offset]
     
     def ReadUInt16(self, offset):
         self.EnsureOffsetInRange(offset, 1)
-        return read16(self.base + offset)
+        return int.from_bytes(self.buffer[offset:offset+2], 'little')
     
     def ReadUInt32(self, offset):
         self.EnsureOffsetInRange(offset, 3)
-        return read32(self.base + offset)
+        return int.from_bytes(self.buffer[offset:offset+4], 'little')
     
     def ReadUInt64(self, offset):
         self.EnsureOffsetInRange(offset, 7)
-        return read64(self.base + offset)
+        return int.from_bytes(self.buffer[offset:offset+8], 'little')
     
     def DecodeUnsigned(self, offset):
-        stream = self.base + offset
-        val = read8(stream)
+        buf = self.buffer
+        val = buf[offset]
         
         if ((val & 1) == 0):
             pvalue = val >> 1
-            stream += 1
+            offset += 1
         elif ((val & 2) == 0):
-            pvalue = (val >> 2) | (u32(read8(stream+1)) << 6)
-            stream += 2
+            pvalue = (val >> 2) | (buf[offset+1] << 6)
+            offset += 2
         elif ((val & 4) == 0):
-            pvalue = (val >> 3) | (u32(read8(stream+1)) << 5) | (u32(read8(stream+2)) << 13)
-            stream += 3
+            pvalue = (val >> 3) | (buf[offset+1] << 5) | (buf[offset+2] << 13)
+            offset += 3
         elif ((val & 8) == 0):
-            pvalue = (val >> 4) | (u32(read8(stream+1)) << 4) | (u32(read8(stream+2)) << 12) | (u32(read8(stream+3)) << 20)
-            stream += 4
+            pvalue = (val >> 4) | (buf[offset+1] << 4) | (buf[offset+2] << 12) | (buf[offset+3] << 20)
+            offset += 4
         elif ((val & 16) == 0):
-            stream += 1
-            pvalue = u32(read32(stream))
-            stream += 4 #this 4 is from the increment in ReadUInt32
+            pvalue = int.from_bytes(buf[offset+1:offset+5], 'little')
+            offset += 5 #1 for the tag byte and 4 for the ReadUInt32
         else:
             raise ValueError("Fuck you")
-        return (stream-self.base, pvalue)
+        return (offset, pvalue)
     
     #returns the new offset as well as the value
     def DecodeSigned(self, offset):
-        stream = self.base + offset
+        buf = self.buffer
         #try to make the casting as deliberate as possible
-        val = s32(read8(stream))  # Read the byte at the current offset
+        val = buf[offset]  # Read the byte at the current offset
 
         if ((val & 1) == 0):
             pvalue = s32(s8(val) >> 1)
-            stream += 1
+            offset += 1
         elif ((val & 2) == 0):
-            pvalue = (val >> 2) | s32(s8(read8(stream+1)) << 6)
-            stream += 2
+            pvalue = (val >> 2) | s32(s8(buf[offset+1]) << 6)
+            offset += 2
         elif ((val & 4) == 0):
-            pvalue = (s32(val) >> 3) | (s32(read8(stream+1)) << 5) | (s32(s8(read8(stream+2))) << 13)
-            stream += 3
+            pvalue = (val >> 3) | (buf[offset+1] << 5) | (s32(s8(buf[offset+2])) << 13)
+            offset += 3
         elif ((val & 8) == 0):
-            pvalue = (val >> 4) | s32(read8(stream+1)) << 4 | s32(read8(stream+2)) << 12 | s32(s8(read8(stream+3)) << 20)
-            stream += 4
+            pvalue = (val >> 4) | buf[offset+1] << 4 | buf[offset+2] << 12 | s32(s8(buf[offset+3]) << 20)
+            offset += 4
         elif ((val & 16) == 0):
-            stream += 1
-            pvalue = s32(read32(stream))
-            stream += 4 #this 4 is to account for the 4 bytes incremented in ReadUInt32
+            pvalue = s32(int.from_bytes(buf[offset+1:offset+5], 'little'))
+            offset += 5 #1 for the tag byte and 4 for the ReadUInt32
         else:
             raise ValueError("Fuck you")
-        return (stream - self.base, pvalue)
+        return (offset, pvalue)
+
+    #https://github.com/dotnet/runtime/blob/cca022b6212f33adc982630ab91469882250256c/src/coreclr/tools/Common/Internal/NativeFormat/NativeFormatReader.Primitives.cs#L181
+    #identical to DecodeUnsigned except for the extra 9 byte form
+    def DecodeUnsignedLong(self, offset):
+        buf = self.buffer
+        if (buf[offset] & 0x3f) == 0x1f:
+            return (offset + 9, int.from_bytes(buf[offset+1:offset+9], 'little'))
+        return self.DecodeUnsigned(offset)
+
+    def DecodeSignedLong(self, offset):
+        buf = self.buffer
+        if (buf[offset] & 0x3f) == 0x1f:
+            return (offset + 9, s64(int.from_bytes(buf[offset+1:offset+9], 'little')))
+        return self.DecodeSigned(offset)
     
     def SkipInteger(self, offset):
-        val = read8(self.base + offset)
+        val = self.buffer[offset]
         
         if (val & 1) == 0:
             return offset + 1
@@ -115,8 +134,105 @@ class NativeReader:
         if numBytes == 0:
             return (offset, '')
         endOffset = offset+numBytes
-        bytes = read(self.base+offset, numBytes)
-        return (endOffset, bytes.decode('utf-8'))
+        return (endOffset, bytes(self.buffer[offset:endOffset]).decode('utf-8'))
+
+    #optional, see VarintIndex
+    def BuildVarintIndex(self):
+        if self.varint_index is None:
+            self.varint_index = VarintIndex(self)
+        return self.varint_index
+
+#The length of a varint is fully determined by the low bits of its first byte (see SkipInteger). 0 means the byte can't start a varint
+def _varint_length(val):
+    for (bit, length) in ((1, 1), (2, 2), (4, 3), (8, 4), (16, 5), (32, 9)):
+        if (val & bit) == 0:
+            return length
+    return 0
+
+VARINT_LENGTHS = bytes(_varint_length(val) for val in range(256))
+
+'''
+Precomputed varint boundaries for a blob (in practice the EmbeddedMetadata blob)
+
+The blob is translated through VARINT_LENGTHS in one pass, which gives the length of the varint that would start at every single offset. Skipping an integer is then one index instead of a decode.
+
+The blob isn't a pure varint stream (strings, raw bytes and fixed size primitives are mixed in) so the boundaries of a collection can't be known before something points at the collection. Instead, the first time a collection is walked its end (and, on request, the offset of every element) is recorded against the collection's offset, and every later Read/lookup of that collection is a dict hit.
+'''
+class VarintIndex:
+    def __init__(self, reader):
+        self.reader = reader
+        self.lengths = bytes(reader.buffer[0:reader.size]).translate(VARINT_LENGTHS)
+        self.collection_ends = dict() #collection offset -> offset right after its last element
+        self.element_offsets = dict() #collection offset -> array of element offsets
+
+    def SkipInteger(self, offset):
+        length = self.lengths[offset]
+        if length == 0:
+            raise ValueError('Bad Image Format Exception')
+        return offset + length
+
+    def SkipIntegers(self, offset, count):
+        lengths = self.lengths
+        for _ in range(count):
+            length = lengths[offset]
+            if length == 0:
+                raise ValueError('Bad Image Format Exception')
+            offset += length
+        return offset
+
+    #offset is the offset of the collection itself, i.e. its count
+    def CollectionEnd(self, offset):
+        end = self.collection_ends.get(offset)
+        if end is None:
+            (elements, count) = self.reader.DecodeUnsigned(offset)
+            end = self.SkipIntegers(elements, count)
+            self.collection_ends[offset] = end
+        return end
+
+    def ElementOffsets(self, offset):
+        offsets = self.element_offsets.get(offset)
+        if offsets is None:
+            (current, count) = self.reader.DecodeUnsigned(offset)
+            offsets = array('I')
+            for _ in range(count):
+                offsets.append(current)
+                current = self.SkipInteger(current)
+            self.element_offsets[offset] = offsets
+            self.collection_ends[offset] = current
+        return offsets
+
+'''
+StringPool
+
+Every ConstantStringValue is a varint length followed by that many UTF-8 bytes. Type and method names get looked up over and over (and the same name shows up under many generic instantiations), so instead of decoding a fresh string each time the pool remembers where each string lives, only decodes it the first time somebody asks, and interns the result so duplicate names share one object.
+
+Predecode() takes a bunch of string offsets and decodes all of them in one in-order pass over the buffer. MetadataReader.PredecodeNames() uses this to warm the pool with the names reachable from the scope definitions. That is not every ConstantStringValue in the blob: records carry no type tag of their own (only the handles pointing at them do) so there is no way to find all string records without walking the handles.
+'''
+class StringPool:
+    def __init__(self, reader):
+        self.reader = reader
+        self.slices = dict() #string offset -> (offset of the bytes, number of bytes)
+        self.strings = dict() #string offset -> interned str
+
+    def GetSlice(self, offset):
+        found = self.slices.get(offset)
+        if found is None:
+            found = self.reader.DecodeUnsigned(offset)
+            self.slices[offset] = found
+        return found
+
+    def GetString(self, offset):
+        value = self.strings.get(offset)
+        if value is None:
+            (start, numBytes) = self.GetSlice(offset)
+            value = sys.intern(bytes(self.reader.buffer[start:start+numBytes]).decode('utf-8'))
+            self.strings[offset] = value
+        return value
+
+    def Predecode(self, offsets):
+        for offset in sorted(set(offsets)):
+            self.GetString(offset)
+        return len(self.strings)
 
 class NativeParser:
     def __init__(self, reader, offset):
@@ -226,28 +342,20 @@ class NativeHashTable:
         if (entry_index_size > 2):
             raise ValueError("Bad image format exception") 
         self.entry_index_size = entry_index_size
+        self.materialized = None #see Materialize
         
     class AllEntriesEnumerator:
+        #built on top of AllEntryOffsets, this just wraps every entry offset in a NativeParser
         def __init__(self, table):
             self.table = table
-            self.current_bucket = 0
-            #self.parser is the parser for the bucket
-            #end_offset is the end of the the current bucket
-            (self.parser, self.end_offset) = table.GetParserForBucket(self.current_bucket)
+            self.entry_offsets = table.AllEntryOffsets()
 
         def __iter__(self):
             return self
         
         #get next basically 
         def __next__(self):
-            while (True):
-                while (self.parser.offset < self.end_offset):
-                    self.parser.GetUInt8() #skip hashcode
-                    return self.parser.GetParserFromRelativeOffset()
-                if (self.current_bucket >= self.table.bucket_mask):
-                    raise StopIteration
-                self.current_bucket += 1
-                (self.parser, self.end_offset) = self.table.GetParserForBucket(self.current_bucket)
+            return NativeParser(self.table.reader, next(self.entry_offsets))
     
     class Enumerator:
         def __init__(self, parser, end_offset, low_hashcode):
@@ -273,7 +381,8 @@ class NativeHashTable:
             raise StopIteration
         
     
-    def GetParserForBucket(self, bucket): #returns the NativeParser and the endOffset
+    #returns the start and end offset of the bucket's entries
+    def GetBucketBounds(self, bucket):
         if (self.entry_index_size == 0):
             bucket_offset = self.base_offset + bucket
             _start = self.reader.ReadUInt8(bucket_offset)
@@ -286,18 +395,155 @@ class NativeHashTable:
             bucket_offset = self.base_offset + 4 * bucket
             _start = self.reader.ReadUInt32(bucket_offset)
             _end = self.reader.ReadUInt32(bucket_offset + 4)
-            
-        end_offset = _end + self.base_offset
-        parser = NativeParser(self.reader, self.base_offset + _start)
         #print('bucket', hex(bucket), 'start', hex(_start), 'end', hex(_end))
-        #print('bucket parser offset', hex(parser.offset), 'addr', hex(parser.GetAddress()), 'bucket', bucket, 'end_offset', hex(end_offset))
-        return (parser, end_offset)
+        return (self.base_offset + _start, self.base_offset + _end)
+
+    def GetParserForBucket(self, bucket): #returns the NativeParser and the endOffset
+        (start_offset, end_offset) = self.GetBucketBounds(bucket)
+        return (NativeParser(self.reader, start_offset), end_offset)
+
+    #Offset-only iteration. These yield plain ints (the offset of every entry) and never build a NativeParser, which is what bulk walkers want
+    def BucketEntryOffsets(self, bucket):
+        (offset, end_offset) = self.GetBucketBounds(bucket)
+        decode_signed = self.reader.DecodeSigned
+        while offset < end_offset:
+            pos = offset + 1 #skip the low hashcode
+            (offset, delta) = decode_signed(pos)
+            yield u32(pos + delta)
+
+    def AllEntryOffsets(self):
+        if self.materialized is not None:
+            #the materialized dict is filled in bucket order, so this is the same order as walking the buckets
+            yield from itertools.chain.from_iterable(self.materialized.values())
+            return
+        for bucket in range(self.bucket_mask + 1):
+            yield from self.BucketEntryOffsets(bucket)
+
+    #decoder(parser) for every entry offset (all of them by default). A single NativeParser is reused for every entry so decoder must not hang on to it, it should return plain values like method_parser.decode_typemap_entry does
+    def DecodeEntries(self, decoder, entry_offsets=None):
+        if entry_offsets is None:
+            entry_offsets = self.AllEntryOffsets()
+        parser = NativeParser(self.reader, 0)
+        results = list()
+        for entry_offset in entry_offsets:
+            parser.offset = entry_offset
+            results.append(decoder(parser))
+        return results
+
+    #returns a list of (low_hashcode, entry offset) for every entry in the bucket, in table order
+    def ReadBucket(self, bucket):
+        (parser, end_offset) = self.GetParserForBucket(bucket)
+        entries = list()
+        while parser.offset < end_offset:
+            low_hashcode = parser.GetUInt8()
+            entries.append((low_hashcode, parser.GetRelativeOffset()))
+        return entries
+
+    #A table only stores the bucket and the low byte of each hashcode, so that is also all that Lookup can tell apart
+    def MaterializedKey(self, hashcode):
+        hashcode = u32(hashcode)
+        return (((hashcode >> 8) & self.bucket_mask) << 8) | (hashcode & 0xff)
+
+    #Decode every bucket once into a dict of MaterializedKey -> [entry offsets]. Afterwards Lookup and AllEntriesEnumerator don't touch the buckets anymore
+    def Materialize(self):
+        if self.materialized is None:
+            materialized = dict()
+            for bucket in range(self.bucket_mask + 1):
+                for (low_hashcode, entry_offset) in self.ReadBucket(bucket):
+                    key = (bucket << 8) | low_hashcode
+                    if key in materialized:
+                        materialized[key].append(entry_offset)
+                    else:
+                        materialized[key] = [entry_offset]
+            self.materialized = materialized
+        return self.materialized
 
     def Lookup(self, hashcode):
+        if self.materialized is not None:
+            entry_offsets = self.materialized.get(self.MaterializedKey(hashcode), ())
+            return iter([NativeParser(self.reader, entry_offset) for entry_offset in entry_offsets])
+
         bucket = (u32(hashcode) >> 8) & self.bucket_mask
         (parser, end_offset) = self.GetParserForBucket(bucket)
         
         return NativeHashTable.Enumerator(parser, end_offset, u8(hashcode))
+
+    #Lookup for a whole batch of hashcodes. The hashcodes are grouped by bucket so every bucket that is needed is only decoded once
+    #returns a dict of u32(hashcode) -> [entry parsers]
+    def LookupMany(self, hashcodes):
+        results = dict()
+        buckets = dict() #bucket -> hashcodes that land in it
+        for hashcode in hashcodes:
+            hashcode = u32(hashcode)
+            if hashcode in results:
+                continue
+            results[hashcode] = list()
+            bucket = (hashcode >> 8) & self.bucket_mask
+            if bucket in buckets:
+                buckets[bucket].append(hashcode)
+            else:
+                buckets[bucket] = [hashcode]
+
+        for (bucket, bucket_hashcodes) in buckets.items():
+            if self.materialized is not None:
+                for hashcode in bucket_hashcodes:
+                    results[hashcode] = [NativeParser(self.reader, entry_offset) for entry_offset in self.materialized.get(self.MaterializedKey(hashcode), ())]
+                continue
+            by_low_hashcode = dict()
+            for (low_hashcode, entry_offset) in self.ReadBucket(bucket):
+                if low_hashcode in by_low_hashcode:
+                    by_low_hashcode[low_hashcode].append(entry_offset)
+                else:
+                    by_low_hashcode[low_hashcode] = [entry_offset]
+            for hashcode in bucket_hashcodes:
+                results[hashcode] = [NativeParser(self.reader, entry_offset) for entry_offset in by_low_hashcode.get(hashcode & 0xff, ())]
+        return results
+
+    #Enumerate every entry like AllEntriesEnumerator, but split the buckets into shards that are decoded by a pool of worker processes
+    #The section is copied into shared memory once and every worker decodes straight out of it. decoder is called with each entry's NativeParser inside the worker, so it has to be a picklable top level function that returns plain values (see method_parser.decode_invokemap_entry)
+    #returns the decoded entries in the same order AllEntriesEnumerator would have produced them
+    #NOTE: this spawns python processes, so it's meant for headless use rather than from inside Binary Ninja
+    def EnumerateParallel(self, decoder, workers=None, shards_per_worker=4):
+        workers = workers or os.cpu_count() or 1
+        bucket_count = self.bucket_mask + 1
+        shard_count = min(bucket_count, workers * shards_per_worker)
+        bounds = [bucket_count * i // shard_count for i in range(shard_count + 1)]
+
+        size = self.reader.size
+        shared = SharedMemory(create=True, size=max(size, 1))
+        try:
+            shared.buf[:size] = self.reader.buffer[0:size]
+            section = (shared.name, self.reader.base, size, self.base_offset - 1)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list()
+                for shard in pool.map(_enumerate_shard, itertools.repeat(section), itertools.repeat(decoder), bounds[:-1], bounds[1:]):
+                    results.extend(shard)
+        finally:
+            shared.close()
+            shared.unlink()
+        return results
+
+#Worker side of NativeHashTable.EnumerateParallel. Every shard attaches to the shared copy of the section, decodes its buckets with a NativeHashTable over it and detaches again, see utils.attach_shared_memory
+#section is (shared memory name, base, size, offset of the table in the section). Decodes buckets [first_bucket, last_bucket)
+def _enumerate_shard(section, decoder, first_bucket, last_bucket):
+    (name, base, size, table_offset) = section
+    with attach_shared_memory(name, size) as buffer:
+        table = NativeHashTable(NativeParser(NativeReader(None, base, size, buffer=buffer), table_offset))
+        entry_offsets = itertools.chain.from_iterable(table.BucketEntryOffsets(bucket) for bucket in range(first_bucket, last_bucket))
+        results = table.DecodeEntries(decoder, entry_offsets)
+        del table #drop the reader (and its view) before the block is closed
+    return results
+
+#one NativeReader per section, cached on the SectionCatalog
+def get_section_reader(session, section_id):
+    return session.sections.get('reader', section_id, lambda start, end: NativeReader(session, start, end-start))
+
+#NativeHashTables never change once the sections are known, so there is one per section per session. materialize builds the lookup dict the first time it's asked for
+def get_hashtable(session, section_id, materialize=False):
+    table = session.sections.get('hashtable', section_id, lambda start, end: NativeHashTable(NativeParser(get_section_reader(session, section_id), 0)))
+    if materialize:
+        table.Materialize()
+    return table
     
 
 # pulled from: https://github.com/dotnet/runtime/blob/6ac8d055a200ccca0d6fa8604c18578234dffa94/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeMetadataReader.cs#L225
@@ -313,11 +559,21 @@ class MetadataHeader:
 
 
 # pulled from: https://github.com/dotnet/runtime/blob/95bae2b141e5d1b8528b1f8620f3e9d459abe640/src/coreclr/tools/Common/Internal/Metadata/NativeFormat/NativeMetadataReader.cs#L162
+#Decoded records are kept in a bounded LRU keyed by (HandleType, offset) so that resolving the same handle again (the stacktrace dumper does this constantly for owning types and names) hands back the same object instead of decoding it again
+#record_cache_size=None makes the cache unbounded and record_cache_size=0 turns it off. cache_hits/cache_misses are there to help pick a size
+DEFAULT_RECORD_CACHE_SIZE = 0x10000
+
 class MetadataReader:
-    def __init__(self, pBuffer, cbBuffer):
-        self.streamReader = NativeReader(pBuffer, u32(cbBuffer))
+    def __init__(self, session, pBuffer, cbBuffer, record_cache_size=DEFAULT_RECORD_CACHE_SIZE):
+        self.streamReader = NativeReader(session, pBuffer, u32(cbBuffer))
         self.header = MetadataHeader()
         self.header.Decode(self.streamReader)
+        self.record_cache = OrderedDict() #(HandleType, offset) -> record
+        self.record_cache_size = record_cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.string_pool = StringPool(self.streamReader)
+        self.names_predecoded = False
 
         @property
         def ScopeDefinitions():
@@ -330,17 +586,77 @@ class MetadataReader:
         def isNull(self, handle):
             return handle.value == NullHandle.value
 
+    #record_class is the record type (TypeDefinition, Method, etc.). It has to have a HANDLE_TYPE
+    def GetRecord(self, record_class, handle):
+        key = (record_class.HANDLE_TYPE, handle.Offset)
+        record = self.record_cache.get(key)
+        if record is not None:
+            self.cache_hits += 1
+            self.record_cache.move_to_end(key)
+            return record
+        self.cache_misses += 1
+        record = record_class(self, handle)
+        if self.record_cache_size != 0:
+            self.record_cache[key] = record
+            if self.record_cache_size is not None and len(self.record_cache) > self.record_cache_size:
+                self.record_cache.popitem(last=False)
+        return record
+
+    def GetString(self, handle):
+        return self.string_pool.GetString(handle.Offset)
+
+    #Warm-up for the string pool: walks scopes -> namespaces -> types (including nested types) -> methods/fields and decodes all of their names in one in-order pass, see StringPool
+    #Worth it for dumpers that look names up in an order that has nothing to do with the blob (hashtable order, stack trace order). Only walks the scopes the first time, so every dumper can just call it. Returns the number of strings in the pool
+    def PredecodeNames(self):
+        if self.names_predecoded:
+            return len(self.string_pool.strings)
+        self.names_predecoded = True
+        offsets = list()
+        def add(handle):
+            if handle.Offset != 0:
+                offsets.append(handle.Offset)
+        def add_type(type_def_handle):
+            type_def = type_def_handle.GetTypeDefinition(self)
+            add(type_def.name)
+            for method_handle in type_def.methods.GetEnumerator():
+                add(method_handle.GetMethod(self).name)
+            for field_handle in type_def.fields.GetEnumerator():
+                add(field_handle.GetField(self).name)
+            for nested_type_handle in type_def.nestedTypes.GetEnumerator():
+                add_type(nested_type_handle)
+        def add_namespace(ns_def_handle):
+            ns_def = ns_def_handle.GetNamespaceDefinition(self)
+            add(ns_def.name)
+            for type_def_handle in ns_def.typeDefinitions.GetEnumerator():
+                add_type(type_def_handle)
+            for child in ns_def.namespaceDefinitions.GetEnumerator():
+                add_namespace(child)
+        for scope_definition_handle in self.header.SCOPE_DEFINITIONS.GetEnumerator():
+            scope_definition = scope_definition_handle.GetScopeDefinition(self)
+            add(scope_definition.name)
+            add(scope_definition.moduleName)
+            add_namespace(scope_definition.rootNamespaceDefinition)
+        return self.string_pool.Predecode(offsets)
+
+    def CacheStats(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self.record_cache), 'max_size': self.record_cache_size}
+
+    def ClearCache(self):
+        self.record_cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
             
 #The metadata reader is created here: https://github.com/dotnet/runtime/blob/f72784faa641a52eebf25d8212cc719f41e02143/src/coreclr/nativeaot/System.Private.TypeLoader/src/Internal/Runtime/TypeLoader/ModuleList.cs#L273
-def create_metadata_reader(): 
-    global METADATA_READER
-    (metadata_start, metadata_end) = find_section_start_end(ReflectionMapBlob.EmbeddedMetadata)  
-    #metadataNativeReader = NativeReader(metadata_start, metadata_end-metadata_start)
-    METADATA_READER = MetadataReader(metadata_start, metadata_end-metadata_start)
-
-#get the global METADATA_READER
-def METADATA_READER():
-    global METADATA_READER
-    return METADATA_READER
-    
+#index_varints builds a VarintIndex over the metadata blob, which makes constructing records with big collections (types with thousands of methods) cheap
+#record_cache_size bounds the per-reader record cache, see MetadataReader
+#a module without EmbeddedMetadata has no metadata reader (session.metadata_reader stays None) and the metadata passes skip it
+def create_metadata_reader(session, index_varints=True, record_cache_size=DEFAULT_RECORD_CACHE_SIZE): 
+    if ReflectionMapBlob.EmbeddedMetadata not in session.sections:
+        print(f'Module {session.module_index} has no EmbeddedMetadata, skipping its metadata')
+        return None
+    (metadata_start, metadata_end) = find_section_start_end(session, ReflectionMapBlob.EmbeddedMetadata)  
+    session.metadata_reader = MetadataReader(session, metadata_start, metadata_end-metadata_start, record_cache_size)
+    if index_varints:
+        session.metadata_reader.streamReader.BuildVarintIndex()
+    return session.metadata_reader
@@ -1,7 +1,17 @@
-from binaryninja import *
+from .utils import *
+import array
+import hashlib
+import itertools
+import os
 import struct
-import ctypes
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 from .rtr import *
+try:
+    import numpy
+except ImportError: #numpy is optional, find_pointer_slots falls back to array
+    numpy = None
 
 #https://github.com/dotnet/runtime/blob/d450d9c9ee4dd5a98812981dac06d2f92bdb8213/src/coreclr/tools/Common/Internal/Runtime/DehydratedData.cs#L20
 class DehydratedDataCommand:
@@ -21,87 +31,454 @@ class DehydratedDataCommand:
     MaxExtraPayloadBytes = 3
     MaxShortPayload = MaxRawShortPayload - MaxExtraPayloadBytes
 
-    def Decode(self, pB):
-        b = pB.read8()
-        command = b & self.DehydratedDataCommandMask
-        payload = b >> self.DehydratedDataCommandPayloadShift
-        extra_bytes = payload - self.MaxShortPayload
+    #returns (pB, command, payload) where pB is the offset of whatever follows the command in blob
+    @staticmethod
+    def Decode(blob, pB):
+        b = blob[pB]
+        pB += 1
+        command = b & DehydratedDataCommand.DehydratedDataCommandMask
+        payload = b >> DehydratedDataCommand.DehydratedDataCommandPayloadShift
+        extra_bytes = payload - DehydratedDataCommand.MaxShortPayload
         if extra_bytes > 0:
-            payload = pB.read8()
+            payload = blob[pB]
             if extra_bytes > 1:
-                payload += (pB.read8() << 8)
+                payload += (blob[pB+1] << 8)
                 if extra_bytes > 2:
-                    payload += (pB.read8() << 16)
-            payload += self.MaxShortPayload
+                    payload += (blob[pB+2] << 16)
+            pB += extra_bytes
+            payload += DehydratedDataCommand.MaxShortPayload
         
-        return (payload, command)
+        return (pB, command, payload)
 
-def ReadRelPtr32(br):
-    #print(hex(br.offset))
-    return br.offset + ctypes.c_int(br.read32()).value
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
 
-def WriteRelPtr32(bw, value):
-    return bw.write32(value-bw.offset)
+HYDRATED_REGION = 'hydrated_mem' #memory region of module 0, see hydrated_region_name
+
+#blob starts at address blob_start, offset is the offset of the relative pointer in blob
+def ReadRelPtr32(blob, blob_start, offset):
+    return blob_start + offset + INT32.unpack_from(blob, offset)[0]
+
+#hydrated starts at address dest_start, offset is where the relative pointer goes in hydrated
+def WriteRelPtr32(hydrated, dest_start, offset, value):
+    UINT32.pack_into(hydrated, offset, (value - (dest_start + offset)) & 0xffffffff)
 
 #reimplement the following algorithm: https://github.com/dotnet/runtime/blob/a3fe47ef1a8def24e8d64c305172199ae5a4ed07/src/coreclr/nativeaot/Common/src/Internal/Runtime/CompilerHelpers/StartupCodeHelpers.cs#L247
-def RehydrateData(bv, start, length):
-    hydrated_start = bv.sections['hydrated'].start
-    hydrated_length = bv.sections['hydrated'].end - hydrated_start
-    pEnd = start+length
-    pCurrentReader = bv.reader(start) #pCurrentReader.offset is pCurrent
-    FixupBr = bv.reader(pEnd) #FixupBr is for reading from pFixups
-    dest_start = ReadRelPtr32(pCurrentReader)
-    assert dest_start == hydrated_start
-    pDestReader = bv.writer(dest_start) #pDestReader.offset is pDest
-    
-    bv.memory_map.remove_memory_region('hydrated_mem')
-    assert bv.memory_map.add_memory_region('hydrated_mem', pDestReader.offset, b'\x00'*hydrated_length)
+#The commands and the fixup table right after them are read in one go and the hydrated data is built up in a bytearray, which is then added with a single add_memory_region. pCurrent, pEnd and pFixups are offsets into blob, pDest is an offset into hydrated
+#blob is what read_dehydrated_blob returns, if the caller already has it
+#The hydrated data goes wherever the commands say it goes, up to dest_end (by default the end of the section it is in, see hydrated_range for binaries with several modules). It is added as the memory region region_name
+def RehydrateData(bv, start, length, blob=None, dest_end=None, region_name=HYDRATED_REGION):
+    if blob is None:
+        blob = read_dehydrated_blob(bv, start, length)
+    dest_start = ReadRelPtr32(blob, start, 0)
+    if dest_end is None:
+        dest_end = section_end(bv, dest_start)
+    hydrated = bytearray(dest_end - dest_start)
+    RunCommands(blob, start, length, hydrated, dest_start, 4, length, 0)
 
-    while pCurrentReader.offset < pEnd:
-        (payload, command) = DehydratedDataCommand.Decode(DehydratedDataCommand, pCurrentReader)
-        #print(hex(br.offset))
+    hydrated = bytes(hydrated)
+    install_hydrated(bv, dest_start, hydrated, region_name)
+    return hydrated
+
+#runs the commands in blob[pCurrent:pEnd], the first one writing to hydrated[pDest]. pFixups is where the fixup table starts (the end of all the commands)
+#A command that would write past the end of hydrated (or copy from past the end of blob) is a bad image, whether hydrated is a bytearray or shared memory
+def RunCommands(blob, start, pFixups, hydrated, dest_start, pCurrent, pEnd, pDest):
+    hydrated_length = len(hydrated)
+    while pCurrent < pEnd:
+        (pCurrent, command, payload) = DehydratedDataCommand.Decode(blob, pCurrent)
         match command:
             case DehydratedDataCommand.Copy:
-                data = pCurrentReader.read(payload)
-                pDestReader.write(data)
+                if pDest + payload > hydrated_length or pCurrent + payload > len(blob):
+                    raise ValueError('Bad Image Format Exception')
+                hydrated[pDest:pDest+payload] = blob[pCurrent:pCurrent+payload]
+                pCurrent += payload
+                pDest += payload
 
             case DehydratedDataCommand.ZeroFill:
-                pDestReader.seek_relative(payload)
+                if pDest + payload > hydrated_length:
+                    raise ValueError('Bad Image Format Exception')
+                pDest += payload
 
             case DehydratedDataCommand.PtrReloc:
-                FixupBr.seek(pEnd + payload*4)
-                val = ReadRelPtr32(FixupBr)
-                pDestReader.write64(val)
+                if pDest + 8 > hydrated_length:
+                    raise ValueError('Bad Image Format Exception')
+                UINT64.pack_into(hydrated, pDest, ReadRelPtr32(blob, start, pFixups + payload*4))
+                pDest += 8
 
             case DehydratedDataCommand.RelPtr32Reloc:
-                FixupBr.seek(pEnd + payload*4)
-                WriteRelPtr32(pDestReader, ReadRelPtr32(FixupBr))
+                if pDest + 4 > hydrated_length:
+                    raise ValueError('Bad Image Format Exception')
+                WriteRelPtr32(hydrated, dest_start, pDest, ReadRelPtr32(blob, start, pFixups + payload*4))
+                pDest += 4
 
             case DehydratedDataCommand.InlinePtrReloc:
+                if pDest + 8*payload > hydrated_length:
+                    raise ValueError('Bad Image Format Exception')
                 for i in range(payload):
-                    val = ReadRelPtr32(pCurrentReader)
-                    pDestReader.write64(val)
+                    UINT64.pack_into(hydrated, pDest, ReadRelPtr32(blob, start, pCurrent))
+                    pCurrent += 4
+                    pDest += 8
 
             case DehydratedDataCommand.InlineRelPtr32Reloc:
+                if pDest + 4*payload > hydrated_length:
+                    raise ValueError('Bad Image Format Exception')
                 for i in range(payload):
-                    WriteRelPtr32(pDestReader, ReadRelPtr32(pCurrentReader))
+                    WriteRelPtr32(hydrated, dest_start, pDest, ReadRelPtr32(blob, start, pCurrent))
+                    pCurrent += 4
+                    pDest += 4
+
+'''
+Parallel rehydration
+
+How much a command writes only depends on the command and its payload, never on the data. So a first pass (PlanCommands) walks the commands without running them and splits them into chunks that each write about the same number of bytes, remembering where every chunk starts in both blob and hydrated. The chunks touch disjoint parts of hydrated, so in the second pass a pool of worker processes runs them with RunCommands, all reading the blob from one shared memory block and writing into another.
+
+This only pays off once the hydrated data is in the tens of MB. Like NativeHashTable.EnumerateParallel it spawns python processes, so it's meant for headless use.
+'''
+
+#returns [(pCurrent, pDest)] for the first command of every chunk, chunks are about chunk_size bytes of hydrated each
+def PlanCommands(blob, pCurrent, pEnd, chunk_size):
+    chunks = [(pCurrent, 0)]
+    pDest = 0
+    next_chunk = chunk_size
+    while pCurrent < pEnd:
+        if pDest >= next_chunk:
+            chunks.append((pCurrent, pDest))
+            next_chunk = pDest + chunk_size
+        (pCurrent, command, payload) = DehydratedDataCommand.Decode(blob, pCurrent)
+        match command:
+            case DehydratedDataCommand.Copy:
+                pCurrent += payload
+                pDest += payload
+            case DehydratedDataCommand.ZeroFill:
+                pDest += payload
+            case DehydratedDataCommand.PtrReloc:
+                pDest += 8
+            case DehydratedDataCommand.RelPtr32Reloc:
+                pDest += 4
+            case DehydratedDataCommand.InlinePtrReloc:
+                pCurrent += 4*payload
+                pDest += 8*payload
+            case DehydratedDataCommand.InlineRelPtr32Reloc:
+                pCurrent += 4*payload
+                pDest += 4*payload
+    return chunks
+
+#same as RehydrateData but with the commands split over workers processes, see above
+def RehydrateDataParallel(bv, start, length, blob=None, workers=None, chunks_per_worker=4, dest_end=None, region_name=HYDRATED_REGION):
+    workers = workers or os.cpu_count() or 1
+    if blob is None:
+        blob = read_dehydrated_blob(bv, start, length)
+    dest_start = ReadRelPtr32(blob, start, 0)
+    if dest_end is None:
+        dest_end = section_end(bv, dest_start)
+    hydrated_length = dest_end - dest_start
+    chunks = PlanCommands(blob, 4, length, max(hydrated_length // (workers * chunks_per_worker), 1))
+    bounds = [pCurrent for (pCurrent, pDest) in chunks[1:]] + [length]
+
+    shared_blob = SharedMemory(create=True, size=max(len(blob), 1))
+    shared_hydrated = SharedMemory(create=True, size=max(hydrated_length, 1)) #shared memory starts out zeroed, which takes care of ZeroFill
+    try:
+        shared_blob.buf[:len(blob)] = blob
+        state = (shared_blob.name, len(blob), shared_hydrated.name, hydrated_length, start, length, dest_start)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_run_chunk, itertools.repeat(state), [pCurrent for (pCurrent, pDest) in chunks], bounds, [pDest for (pCurrent, pDest) in chunks]))
+        hydrated = bytes(shared_hydrated.buf[:hydrated_length])
+    finally:
+        for shared in (shared_blob, shared_hydrated):
+            shared.close()
+            shared.unlink()
+    install_hydrated(bv, dest_start, hydrated, region_name)
+    return hydrated
+
+#Worker side of RehydrateDataParallel, runs the commands in [pCurrent, pEnd) starting at pDest. Every chunk attaches to both shared memory blocks and detaches again once it's done, see utils.attach_shared_memory
+def _run_chunk(state, pCurrent, pEnd, pDest):
+    (blob_name, blob_size, hydrated_name, hydrated_size, start, length, dest_start) = state
+    with attach_shared_memory(blob_name, blob_size) as blob, attach_shared_memory(hydrated_name, hydrated_size) as hydrated:
+        RunCommands(blob, start, length, hydrated, dest_start, pCurrent, pEnd, pDest)
+
+'''
+Dry run
+
+DehydratedDataStats walks the commands the same way RunCommands does but doesn't write anything, it just adds up what every command would do. Nothing is asserted either: if the stream doesn't decode cleanly, error says where it went wrong and the counts cover everything up to that point. dehydrated_data_stats does this for a session without touching the memory map (a module without DehydratedData gets an error too), so it can be run over a whole corpus with headless.PEImage.
+
+{
+    'destination': address the hydrated data goes to (None if there aren't even 4 bytes of commands),
+    'hydrated_size': number of bytes the commands write (the final pDest),
+    'commands': number of commands of every type, by name,
+    'bytes': bytes of hydrated written by every type of command, by name,
+    'relocations': pointers written (PtrReloc, RelPtr32Reloc and every pointer of the Inline variants),
+    'fixup_table_size': number of entries that fit between the end of the commands and the end of the section,
+    'fixup_references': number of PtrReloc/RelPtr32Reloc commands,
+    'fixups_used': number of distinct fixup table entries they use,
+    'max_fixup': highest fixup table entry used (None if there are none),
+    'error': None, or what went wrong,
+}
+'''
+
+COMMAND_NAMES = {
+    DehydratedDataCommand.Copy: 'Copy',
+    DehydratedDataCommand.ZeroFill: 'ZeroFill',
+    DehydratedDataCommand.RelPtr32Reloc: 'RelPtr32Reloc',
+    DehydratedDataCommand.PtrReloc: 'PtrReloc',
+    DehydratedDataCommand.InlineRelPtr32Reloc: 'InlineRelPtr32Reloc',
+    DehydratedDataCommand.InlinePtrReloc: 'InlinePtrReloc',
+}
+
+#blob starts at start and has length bytes of commands, see above. hydrated_length is the size of the hydrated section, if known, to check the commands against
+def DehydratedDataStats(blob, start, length, hydrated_length=None):
+    commands = {name: 0 for name in COMMAND_NAMES.values()}
+    written = {name: 0 for name in COMMAND_NAMES.values()}
+    fixups = set()
+    fixup_references = 0
+    relocations = 0
+    fixup_table_size = max(len(blob) - length, 0) // 4
+    error = None
+    pCurrent = 4
+    pEnd = length
+    pDest = 0
+    destination = ReadRelPtr32(blob, start, 0) if length >= 4 and len(blob) >= 4 else None
+    if destination is None:
+        error = f'{length} bytes of commands at {hex(start)} is too short for the destination'
+    while error is None and pCurrent < pEnd:
+        command_start = pCurrent
+        try:
+            (pCurrent, command, payload) = DehydratedDataCommand.Decode(blob, pCurrent)
+        except IndexError:
+            error = f'truncated command at {hex(start + command_start)}'
+            break
+        name = COMMAND_NAMES.get(command)
+        if name is None:
+            error = f'unknown command {command} at {hex(start + command_start)}'
+            break
+        match command:
+            case DehydratedDataCommand.Copy:
+                size = payload
+                pCurrent += payload
+            case DehydratedDataCommand.ZeroFill:
+                size = payload
+            case DehydratedDataCommand.PtrReloc | DehydratedDataCommand.RelPtr32Reloc:
+                size = 8 if command == DehydratedDataCommand.PtrReloc else 4
+                relocations += 1
+                fixup_references += 1
+                fixups.add(payload)
+                if payload >= fixup_table_size:
+                    error = f'fixup {payload} at {hex(start + command_start)} is past the end of the fixup table'
+            case DehydratedDataCommand.InlinePtrReloc | DehydratedDataCommand.InlineRelPtr32Reloc:
+                size = (8 if command == DehydratedDataCommand.InlinePtrReloc else 4) * payload
+                relocations += payload
+                pCurrent += 4*payload
+        commands[name] += 1
+        written[name] += size
+        pDest += size
+        if error is None and pCurrent > pEnd:
+            error = f'{name} at {hex(start + command_start)} runs past the end of the commands'
+        if error is None and hydrated_length is not None and pDest > hydrated_length:
+            error = f'{name} at {hex(start + command_start)} writes past the end of the hydrated section'
+        if error is not None:
+            break
+    return {
+        'destination': destination,
+        'hydrated_size': pDest,
+        'commands': commands,
+        'bytes': written,
+        'relocations': relocations,
+        'fixup_table_size': fixup_table_size,
+        'fixup_references': fixup_references,
+        'fixups_used': len(fixups),
+        'max_fixup': max(fixups) if fixups else None,
+        'error': error,
+    }
+
+#dry run of do_rehydration, see above. Only needs populate_sections to have been run
+def dehydrated_data_stats(session):
+    bv = session.bv
+    if ReadyToRunSectionType.DehydratedData not in session.sections:
+        stats = DehydratedDataStats(b'', 0, 0)
+        stats['error'] = f'module {session.module_index} has no DehydratedData'
+        return stats
+    (start, end) = find_section_start_end(session, ReadyToRunSectionType.DehydratedData)
+    blob = read_dehydrated_blob(bv, start, end-start)
+    destination = ReadRelPtr32(blob, start, 0) if end-start >= 4 and len(blob) >= 4 else None
+    if destination is None or not bv.get_sections_at(destination):
+        stats = DehydratedDataStats(blob, start, end-start)
+        if stats['error'] is None:
+            stats['error'] = f'commands hydrate to {hex(stats["destination"])} which is not in any section'
+        return stats
+    (dest_start, dest_end) = hydrated_range(session)
+    return DehydratedDataStats(blob, start, end-start, dest_end - dest_start)
+
+#the commands and the fixup table after them
+def read_dehydrated_blob(bv, start, length):
+    blob_end = max([section.end for section in bv.get_sections_at(start)] + [start+length]) #the fixup table runs to at most the end of the section
+    return bytes(bv.read(start, blob_end - start))
+
+#source is the hydrated image or the path of a file holding it
+def install_hydrated(bv, dest_start, source, region_name=HYDRATED_REGION):
+    bv.memory_map.remove_memory_region(region_name)
+    assert bv.memory_map.add_memory_region(region_name, dest_start, source)
+
+#the hydrated data can't go past the end of the section it is in
+def section_end(bv, address):
+    sections = bv.get_sections_at(address)
+    if not sections:
+        raise ValueError('Bad Image Format Exception')
+    return min(section.end for section in sections)
+
+'''
+Modules
+
+Every module has its own DehydratedData and its own destination for it (the first relative pointer in the blob). A module's hydrated data runs from there up to the next module's destination in the same section, or the end of the section, and gets its own memory region (hydrated_region_name). Modules without a DehydratedData section have nothing to rehydrate and are skipped.
+'''
+
+def hydrated_region_name(session):
+    if session.module_index == 0:
+        return HYDRATED_REGION
+    return f'{HYDRATED_REGION}_{session.module_index}'
+
+#where the module's hydrated data starts, None if it has no DehydratedData
+def dehydrated_destination(session):
+    if ReadyToRunSectionType.DehydratedData not in session.sections:
+        return None
+    (start, end) = find_section_start_end(session, ReadyToRunSectionType.DehydratedData)
+    return start + s32(session.read32(start))
+
+#[start, end) of the module's hydrated data, see above
+def hydrated_range(session):
+    dest_start = dehydrated_destination(session)
+    dest_end = section_end(session.bv, dest_start)
+    for module in session.modules:
+        other = dehydrated_destination(module) if module is not session else None
+        if other is not None and dest_start < other < dest_end:
+            dest_end = other
+    return (dest_start, dest_end)
         
-def detect_pointers(bv): #this function works best rebased
-    br = bv.reader(bv.sections['hydrated'].start)
-    
-    while br.offset < bv.sections['hydrated'].end:
-        potential_ptr = br.read64()
-        if bv.start <= potential_ptr < bv.end:
-            bv.define_data_var(br.offset, Type.pointer(bv.arch, Type.void()))
+'''
+Pointer detection
 
+Every 8 byte aligned slot of the hydrated data that holds a value inside the image is defined as a void pointer. find_pointer_slots does the search on the whole hydrated image at once (NumPy if it is installed, otherwise array), define_pointers then defines all of them with analysis on hold so Binary Ninja only reanalyzes once at the end.
 
-def do_rehydration(bv):
-    (start, end) = find_section_start_end(ReadyToRunSectionType.DehydratedData)
-    RehydrateData(bv, start, end-start)
-    detect_pointers(bv)
+targets narrows the search down to slots pointing at known addresses, e.g. [f.start for f in bv.functions] or the MethodTables from method_parser.collect_typemap.
+'''
 
+#returns the addresses of every slot in data (which starts at start) that points into the image (or at one of targets)
+def find_pointer_slots(bv, data, start, targets=None):
+    count = len(data) // 8
+    if numpy is not None:
+        values = numpy.frombuffer(data, dtype='<u8', count=count)
+        mask = (values >= bv.start) & (values < bv.end)
+        if targets is not None:
+            mask &= numpy.isin(values, numpy.fromiter(targets, dtype=numpy.uint64))
+        return [start + int(index)*8 for index in numpy.flatnonzero(mask)]
+    values = array.array('Q', bytes(data[:count*8]))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    image_start = bv.start
+    image_end = bv.end
+    if targets is not None:
+        targets = set(targets)
+        return [start + index*8 for (index, value) in enumerate(values) if value in targets]
+    return [start + index*8 for (index, value) in enumerate(values) if image_start <= value < image_end]
 
+def define_pointers(bv, slots):
+    void_pointer = Type.pointer(bv.arch, Type.void())
+    bv.set_analysis_hold(True)
+    try:
+        for slot in slots:
+            bv.define_data_var(slot, void_pointer)
+    finally:
+        bv.set_analysis_hold(False)
+    bv.update_analysis()
 
+#data is the hydrated image if the caller already has it (RehydrateData returns it), otherwise [start, end) is read out of the view (by default the whole hydrated section). Returns the slots that were defined
+def detect_pointers(bv, data=None, targets=None, start=None, end=None): #this function works best rebased
+    if start is None:
+        start = bv.sections['hydrated'].start
+        end = bv.sections['hydrated'].end
+    if data is None:
+        data = bv.read(start, end - start)
+    slots = find_pointer_slots(bv, data, start, targets)
+    define_pointers(bv, slots)
+    return slots
 
-    
 
+'''
+Hydrated image cache
+
+What RehydrateData produces only depends on the dehydrated blob (commands and fixups), where that blob is and where the hydrated data goes (hydrated_range). So do_rehydration keeps its output next to the database (see utils.database_path):
+
+{database}.{key}.hydrated - the hydrated image, byte for byte
+{database}.{key}.slots - the pointer slots detect_pointers found, as little endian uint64s
+
+where key is the sha256 of all of the above and REHYDRATE_VERSION. On the next load the .hydrated file is passed to add_memory_region as a path so it gets mapped straight from disk, and the commands are never interpreted again. Bump REHYDRATE_VERSION whenever RehydrateData or detect_pointers changes what they produce.
+'''
+
+REHYDRATE_VERSION = 1
+
+def hydrated_cache_key(blob, start, length, dest_start, dest_end):
+    digest = hashlib.sha256()
+    digest.update(struct.pack('<IQQQQ', REHYDRATE_VERSION, start, length, dest_start, dest_end))
+    digest.update(blob)
+    return digest.hexdigest()
+
+def hydrated_cache_paths(bv, key):
+    base = f'{database_path(bv)}.{key}'
+    return (f'{base}.hydrated', f'{base}.slots')
+
+def save_slots(path, slots):
+    values = array.array('Q', slots)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    write_file_atomic(path, values.tobytes())
+
+#None if there is no slots file
+def load_slots(path):
+    try:
+        with open(path, 'rb') as f:
+            values = array.array('Q', f.read())
+    except (OSError, ValueError):
+        return None
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tolist()
+
+#with use_cache the hydrated image (and the pointer slots) come from, or go into, the files described above
+#with workers the commands are run by RehydrateDataParallel
+#a module without DehydratedData is skipped, returns whether there was anything to rehydrate
+def do_rehydration(session, use_cache=True, workers=None):
+    bv = session.bv
+    if ReadyToRunSectionType.DehydratedData not in session.sections:
+        print(f'Module {session.module_index} has no DehydratedData, nothing to rehydrate')
+        return False
+    (start, end) = find_section_start_end(session, ReadyToRunSectionType.DehydratedData)
+    (dest_start, dest_end) = hydrated_range(session)
+    region_name = hydrated_region_name(session)
+    blob = read_dehydrated_blob(bv, start, end-start)
+    (hydrated_path, slots_path) = hydrated_cache_paths(bv, hydrated_cache_key(blob, start, end-start, dest_start, dest_end))
+    if use_cache and os.path.exists(hydrated_path):
+        install_hydrated(bv, dest_start, hydrated_path, region_name)
+        hydrated = None #detect_pointers reads it back out of the view if the slots aren't cached
+        print('Loaded hydrated image', hydrated_path)
+    else:
+        if workers:
+            hydrated = RehydrateDataParallel(bv, start, end-start, blob, workers, dest_end=dest_end, region_name=region_name)
+        else:
+            hydrated = RehydrateData(bv, start, end-start, blob, dest_end, region_name)
+        if use_cache:
+            try:
+                write_file_atomic(hydrated_path, hydrated)
+            except OSError as e:
+                print('Could not write hydrated image', e)
+    if is_headless(bv): #defining data vars is pure annotation
+        return True
+    slots = load_slots(slots_path) if use_cache else None
+    if slots is not None:
+        define_pointers(bv, slots)
+        return True
+    slots = detect_pointers(bv, hydrated, start=dest_start, end=dest_end)
+    if use_cache:
+        try:
+            save_slots(slots_path, slots)
+        except OSError as e:
+            print('Could not write pointer slots', e)
+    return True
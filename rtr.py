@@ -1,13 +1,13 @@
-from binaryninja import *
+from .utils import *
+from .session import *
 from enum import IntEnum
 
-SECTIONS = list()
-
 
 #pulled from: https://github.com/dotnet/runtime/blob/a3fe47ef1a8def24e8d64c305172199ae5a4ed07/src/coreclr/tools/Common/Internal/Runtime/ModuleHeaders.cs#L93
 
 #pulled from: https://github.com/dotnet/runtime/blob/a3fe47ef1a8def24e8d64c305172199ae5a4ed07/src/coreclr/nativeaot/Runtime/inc/ModuleHeaders.h#L10
 READY_TO_RUN_SIG = b'\x52\x54\x52\x00'
+READY_TO_RUN_HEADER_SIZE = 16
 
 class ReadyToRunSectionType(IntEnum):
         #
@@ -83,25 +83,216 @@ def initialize_types(bv):
         module_info_row.append(Type.pointer(bv.arch, Type.void()), 'End')
         bv.define_type(Type.generate_auto_type_id('source', 'ModuleInfoRow'), 'ModuleInfoRow', module_info_row.immutable_copy())
         
+'''
+Finding the ReadyToRun headers
+
+A binary has one ReadyToRun header per module (type manager). Most binaries only have one, but every one of them has to be found or the metadata of the other modules is lost. There are two ways to find them, tried in this order:
+
+1. modules_array: StartupCodeHelpers::InitializeModules is called from wmain and its second argument is a pointer to an array of ReadyToRunHeader pointers, the third argument is the length of that array (see writeup.md). If the address of that array is known (passed in, or recovered from the call site when Binary Ninja knows where InitializeModules is) the headers are just the pointers in it. Null entries are skipped like InitializeModules does. If the length isn't known the array is read until the first pointer that isn't a header.
+2. signature_scan: otherwise .rdata is pulled into memory in one read and searched for 'RTR\0' with bytes.find (which does the searching in C). Every hit is validated before it is accepted, so stray 'RTR\0' bytes are skipped.
+
+Either way every header is validated with read_ready_to_run_header, and locate_ready_to_run_headers reports which strategy found them.
+
+populate_sections turns the first header into session.sections and every further header into another AotSession in session.modules, see session.py.
+'''
+
+READY_TO_RUN_MAX_SECTIONS = 0x400 #real headers have a few dozen
+READY_TO_RUN_MAX_MODULES = 0x100 #only used to bound reading a modules array of unknown length
+
+#reads and validates the header at address. Returns None if it doesn't look like a ReadyToRunHeader
 #This is similar to this code: https://github.com/dotnet/runtime/blob/a3fe47ef1a8def24e8d64c305172199ae5a4ed07/src/coreclr/tools/aot/ILCompiler.Reflection.ReadyToRun/ReadyToRunHeader.cs#L93
-def populate_sections(bv):
-    global SECTIONS
-    rdata_address = bv.sections['.rdata'].start #the ReadyToRun header is always in rdata
-    ready_to_run_header = bv.find_next_data(rdata_address, READY_TO_RUN_SIG)
-    print(f'ReadyToRun Header Section: {hex(ready_to_run_header)}')
-    bv.define_data_var(ready_to_run_header, 'ReadyToRunHeader') #define as a ReadyToRunHeader
-    header_val = bv.get_data_var_at(ready_to_run_header).value
-    major_version = header_val['MajorVersion']
-    minor_version = header_val['MinorVersion']
-    print(f'Major Version: {major_version}, Minor Version: {minor_version}')
-    section_header_start = ready_to_run_header + bv.get_data_var_at(ready_to_run_header).type.width
-    bv.define_data_var(section_header_start, Type.array(bv.get_type_by_name('ModuleInfoRow'), header_val['NumberOfSections']))
-    SECTIONS = bv.get_data_var_at(section_header_start).value
+def read_ready_to_run_header(session, address):
+    bv = session.bv
+    header = session.read(address, READY_TO_RUN_HEADER_SIZE)
+    if header is None or len(header) != READY_TO_RUN_HEADER_SIZE or bytes(header[0:4]) != READY_TO_RUN_SIG:
+        return None
+    major_version = int.from_bytes(header[4:6], 'little')
+    minor_version = int.from_bytes(header[6:8], 'little')
+    flags = int.from_bytes(header[8:12], 'little')
+    number_of_sections = int.from_bytes(header[12:14], 'little')
+    entry_size = header[14]
+    if major_version == 0 or number_of_sections == 0 or number_of_sections > READY_TO_RUN_MAX_SECTIONS:
+        return None
+    pointer_size = (entry_size - 8) // 2 #SectionId and Flags are 4 bytes each, Start and End are pointers
+    if pointer_size not in (4, 8) or entry_size != 8 + 2*pointer_size:
+        return None
+
+    rows_address = address + READY_TO_RUN_HEADER_SIZE
+    data = session.read(rows_address, number_of_sections * entry_size)
+    if data is None or len(data) != number_of_sections * entry_size:
+        return None
+    rows = list()
+    for i in range(number_of_sections):
+        row = i*entry_size
+        start = int.from_bytes(data[row+8:row+8+pointer_size], 'little')
+        end = int.from_bytes(data[row+8+pointer_size:row+8+2*pointer_size], 'little')
+        if end < start or start < bv.start or end > bv.end: #every section lives inside the image
+            return None
+        rows.append({
+            'SectionId': s32(int.from_bytes(data[row:row+4], 'little')),
+            'Flags': int.from_bytes(data[row+4:row+8], 'little'),
+            'Start': start,
+            'End': end,
+        })
+    return {
+        'Address': address,
+        'MajorVersion': major_version,
+        'MinorVersion': minor_version,
+        'Flags': flags,
+        'NumberOfSections': number_of_sections,
+        'EntrySize': entry_size,
+        'Rows': rows,
+    }
+
+#recover the (modules array, count) arguments of every call to InitializeModules. count is None if it isn't a constant. Only possible when Binary Ninja has a function with that name
+def find_modules_arrays(session):
+    bv = session.bv
+    if is_headless(bv):
+        return []
+    modules_arrays = list()
+    for func in [f for f in bv.functions if 'InitializeModules' in f.name]:
+        for ref in bv.get_code_refs(func.start):
+            try:
+                params = ref.function.get_llil_at(ref.address).mlil.params
+                (modules_array, count) = (constant_value(params[1]), constant_value(params[2]))
+            except Exception: #not a call we understand
+                continue
+            if modules_array is not None:
+                modules_arrays.append((modules_array, count))
+    return modules_arrays
+
+def constant_value(param):
+    value = param.value
+    if value.type in (RegisterValueType.ConstantValue, RegisterValueType.ConstantPointerValue):
+        return value.value
+    return None
+
+def read_pointer(session, address):
+    if session.bv.address_size == 8:
+        return session.read64(address)
+    return session.read32(address)
+
+#reads the headers out of a modules array. Without count the array ends at the first entry that isn't a header
+def read_modules_array(session, modules_array, count=None):
+    pointer_size = session.bv.address_size
+    headers = list()
+    for i in range(count if count is not None else READY_TO_RUN_MAX_MODULES):
+        header_address = read_pointer(session, modules_array + i*pointer_size)
+        if not header_address:
+            if count is not None:
+                continue #InitializeModules skips null entries
+            break
+        header = read_ready_to_run_header(session, header_address)
+        if header is None:
+            if count is not None:
+                return [] #not a modules array after all
+            break
+        headers.append(header)
+    return headers
+
+#searches .rdata (or every section if there is no .rdata) for every valid header
+def scan_for_ready_to_run_headers(session):
+    bv = session.bv
+    if '.rdata' in bv.sections:
+        sections = [bv.sections['.rdata']]
+    else:
+        sections = sorted(bv.sections.values(), key=lambda section: section.start)
+    headers = list()
+    for section in sections:
+        data = session.read(section.start, section.end - section.start)
+        if data is None:
+            continue
+        data = bytes(data)
+        found = data.find(READY_TO_RUN_SIG)
+        while found != -1:
+            header = read_ready_to_run_header(session, section.start + found)
+            if header is not None:
+                headers.append(header)
+                found += READY_TO_RUN_HEADER_SIZE + header['NumberOfSections']*header['EntrySize'] #skip over the rows
+            else:
+                found += 1
+            found = data.find(READY_TO_RUN_SIG, found)
+    return headers
+
+#returns (headers, strategy), see above. modules_array is the address of the array InitializeModules is called with and count its length, if they are already known
+def locate_ready_to_run_headers(session, modules_array=None, count=None):
+    candidates = [(modules_array, count)] if modules_array is not None else list()
+    candidates += find_modules_arrays(session)
+    for (candidate, candidate_count) in candidates:
+        headers = read_modules_array(session, candidate, candidate_count)
+        if headers:
+            return (headers, 'modules_array')
+    headers = scan_for_ready_to_run_headers(session)
+    if headers:
+        return (headers, 'signature_scan')
+    raise ValueError('Could not find the ReadyToRun header')
+
+#The header and the ModuleInfoRows are parsed by hand so this also works headless. With a real BinaryView they are also defined as data vars
+#session gets the sections of the first module, every other module gets its own AotSession in session.modules
+def populate_sections(session, modules_array=None, count=None):
+    bv = session.bv
+    (headers, strategy) = locate_ready_to_run_headers(session, modules_array, count)
+    for (index, header) in enumerate(headers):
+        print(f'ReadyToRun Header Section: {hex(header["Address"])} (module {index}, found by {strategy})')
+        print(f'Major Version: {header["MajorVersion"]}, Minor Version: {header["MinorVersion"]}')
+        add_module_sections(session, index, header['Address'], header['Rows'])
+    return strategy
+
+#same result as populate_sections, from [(header address, ModuleInfoRows)] that were found before (see cache.load_cached_sections). Nothing is searched for or validated
+def restore_sections(session, modules):
+    for (index, (ready_to_run_header, rows)) in enumerate(modules):
+        add_module_sections(session, index, ready_to_run_header, rows)
+
+def add_module_sections(session, index, ready_to_run_header, rows):
+    bv = session.bv
+    module = session if index == 0 else session.add_module()
+    module.header = ready_to_run_header
+    module.sections = SectionCatalog(rows)
+    if not is_headless(bv):
+        section_header_start = ready_to_run_header + READY_TO_RUN_HEADER_SIZE
+        bv.define_data_var(ready_to_run_header, 'ReadyToRunHeader') #define as a ReadyToRunHeader
+        bv.define_data_var(section_header_start, Type.array(bv.get_type_by_name('ModuleInfoRow'), len(rows)))
+    return module
     
-def find_section_start_end(section_id):
-    global SECTIONS
-    for section in SECTIONS:
-        if section['SectionId'] == section_id:
-            return (section['Start'], section['End'])
-    raise ValueError('Could not find section', section_id)
+'''
+SectionCatalog
+
+The ModuleInfoRows from the ReadyToRun header, indexed by SectionId. populate_sections builds it once and it lives on session.sections.
+
+Besides the rows, the catalog also holds on to whatever has been built on top of a section (its NativeReader, NativeHashTable, ExternalReferencesTable, ...) so every one of those is only ever created once per section. See nativeformat.get_section_reader, nativeformat.get_hashtable and misc.get_external_references.
+'''
+class SectionCatalog:
+    def __init__(self, rows):
+        self.rows = rows #ModuleInfoRows in header order
+        self.by_id = dict()
+        for row in rows:
+            self.by_id.setdefault(row['SectionId'], row) #the first row wins, like the old linear search
+        self.objects = dict() #(kind, section id) -> object built on top of that section
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, section_id):
+        return section_id in self.by_id
+
+    def find(self, section_id):
+        row = self.by_id.get(section_id)
+        if row is None:
+            raise ValueError('Could not find section', section_id)
+        return (row['Start'], row['End'])
+
+    #factory(start, end) is only called the first time (kind, section_id) is asked for
+    def get(self, kind, section_id, factory):
+        key = (kind, section_id)
+        found = self.objects.get(key)
+        if found is None:
+            found = factory(*self.find(section_id))
+            self.objects[key] = found
+        return found
+
+def find_section_start_end(session, section_id):
+    return session.sections.find(section_id)
         
@@ -0,0 +1,101 @@
+from .utils import *
+from collections import namedtuple
+
+'''
+Everything that belongs to a single binary lives on an AotSession instead of in module globals
+
+The session owns the reader for the binary, the blobs that have been pulled into memory, the ReadyToRun section catalog (which also caches the per-section readers, ExternalReferencesTables and NativeHashTables) and the MetadataReader. It is passed explicitly to NativeReader, ExternalReferencesTable, TypeLoaderEnvironment and the dumpers, so any number of binaries can be open at once in one process.
+
+A single session wraps a single reader, so it should only be used from one thread at a time. Different sessions are completely independent.
+
+close() (or a with block) drops everything the session and its modules hold on to and closes a headless.PEImage. Without it a headless session keeps its file and mapping open until the cycle collector gets around to it (modules refers back to the session, and so do the readers), which adds up in long running batch workers.
+
+Modules
+
+A binary can hold several modules, each with its own ReadyToRun header, sections and metadata blob (see rtr.populate_sections). Every module is an AotSession of its own: the session doit starts with is module 0 and session.modules lists all of them, itself included. Everything that takes a session works on a single module, map_modules runs something over all of them. Not every module has to have every section, a module without EmbeddedMetadata ends up with metadata_reader None and the metadata passes skip it.
+'''
+
+class AotSession:
+    def __init__(self, bv):
+        self.bv = bv #BinaryView or headless.PEImage
+        self.reader = bv.reader(0)
+        self.buffers = dict() #(address, length) -> memoryview of that blob, so every blob is only pulled out of the binary once
+        self.header = None #address of the ReadyToRun header of this module, filled in by rtr.populate_sections
+        self.sections = None #rtr.SectionCatalog, filled in by rtr.populate_sections
+        self.metadata_reader = None #filled in by nativeformat.create_metadata_reader
+        self.cache = None #decoded results from the on-disk cache, see cache.load_or_build_cache
+        self.module_index = 0 #index of this module in modules
+        self.modules = [self] #every module in the binary, filled in by rtr.populate_sections
+
+    def read8(self, address):
+        return self.reader.read8(address)
+
+    def read16(self, address):
+        return self.reader.read16(address)
+
+    def read32(self, address):
+        return self.reader.read32(address)
+
+    def read64(self, address):
+        return self.reader.read64(address)
+
+    def read(self, address, read_len):
+        return self.reader.read(read_len, address)
+
+    #load [address, address+length) into memory once and hand back a memoryview over it
+    def load_buffer(self, address, length):
+        key = (address, length)
+        if key not in self.buffers:
+            data = self.read(address, length)
+            if data is None or len(data) != length:
+                self.buffers[key] = LazyBuffer(self, address, length)
+            else:
+                self.buffers[key] = memoryview(data)
+        return self.buffers[key]
+
+    #everything held for every module is dropped first, the blobs in buffers are views into the mapping of a headless.PEImage which can't be unmapped while they are alive. A BinaryView is left open, it belongs to Binary Ninja
+    def close(self):
+        modules = self.modules
+        for module in modules:
+            for buffer in module.buffers.values():
+                if isinstance(buffer, memoryview):
+                    buffer.release()
+            module.buffers.clear()
+            module.sections = None
+            module.metadata_reader = None
+            module.cache = None
+            module.modules = [module]
+        if is_headless(self.bv):
+            self.bv.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #another module in the same binary, with its own reader
+    def add_module(self):
+        module = AotSession(self.bv)
+        module.module_index = len(self.modules)
+        module.modules = self.modules
+        self.modules.append(module)
+        return module
+
+#runs func(module) for every module of session and returns the results in module order
+#The modules are done one after the other: decoding is pure python, so threads wouldn't buy anything. The parallelism is inside the passes themselves (the workers of NativeHashTable.EnumerateParallel and RehydrateDataParallel)
+def map_modules(session, func):
+    return [func(module) for module in session.modules]
+
+#what doit_headless returns. Unpacks like a plain (session, symbols) tuple, and closes the session at the end of a with block
+class HeadlessResult(namedtuple('HeadlessResult', ['session', 'symbols'])):
+    __slots__ = ()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,186 @@
+from .utils import *
+from .dotnet_enums import *
+from .autogen.autogen_nativeformat import *
+from .method_parser import *
+from .stacktrace_parser import *
+from .cache import *
+import sqlite3
+
+'''
+SQLite export of the reflection metadata
+
+export_sqlite(session, path) walks every scope -> namespace -> type (including nested types) -> method/field once and streams the rows into a SQLite database so the metadata can be queried without Binary Ninja (or python) in the loop. Everything is inserted with executemany in batches inside a single transaction and the indexes are only built once all the rows are in.
+
+Every module in session.modules is exported. Every metadata record is keyed by the index of its module and its offset in the metadata blob of that module, which is also what the handles point at. References between records (scope, parent, namespace, owning_type, type, method, ...) are offsets within the same module. Addresses (entrypoints, stack trace methods, MethodTables) are stored both as the address and as the RVA from the image base.
+
+Tables:
+
+scopes(module, offset, name, module_name, major_version, minor_version, build_number, revision_number)
+namespaces(module, offset, scope, parent, name, full_name)
+types(module, offset, namespace, enclosing_type, name, full_name, flags)
+methods(module, offset, owning_type, name, flags, impl_flags)
+fields(module, offset, owning_type, name, flags, field_offset)
+strings(module, offset, value) - every ConstantStringValue that was decoded along the way
+type_map(module, method_table, rva, type)
+entrypoints(module, address, rva, method_table, method)
+stacktrace(module, address, rva, name)
+
+Example: all methods in namespace X with an entrypoint
+
+SELECT t.full_name, m.name, e.rva FROM methods m JOIN types t ON m.module = t.module AND m.owning_type = t.offset JOIN namespaces n ON t.module = n.module AND t.namespace = n.offset JOIN entrypoints e ON e.module = m.module AND e.method = m.offset WHERE n.full_name = 'X'
+'''
+
+SCHEMA = [
+    'CREATE TABLE scopes (module INTEGER, offset INTEGER, name TEXT, module_name TEXT, major_version INTEGER, minor_version INTEGER, build_number INTEGER, revision_number INTEGER, PRIMARY KEY (module, offset))',
+    'CREATE TABLE namespaces (module INTEGER, offset INTEGER, scope INTEGER, parent INTEGER, name TEXT, full_name TEXT, PRIMARY KEY (module, offset))',
+    'CREATE TABLE types (module INTEGER, offset INTEGER, namespace INTEGER, enclosing_type INTEGER, name TEXT, full_name TEXT, flags INTEGER, PRIMARY KEY (module, offset))',
+    'CREATE TABLE methods (module INTEGER, offset INTEGER, owning_type INTEGER, name TEXT, flags INTEGER, impl_flags INTEGER, PRIMARY KEY (module, offset))',
+    'CREATE TABLE fields (module INTEGER, offset INTEGER, owning_type INTEGER, name TEXT, flags INTEGER, field_offset INTEGER, PRIMARY KEY (module, offset))',
+    'CREATE TABLE strings (module INTEGER, offset INTEGER, value TEXT, PRIMARY KEY (module, offset))',
+    'CREATE TABLE type_map (module INTEGER, method_table INTEGER, rva INTEGER, type INTEGER)',
+    'CREATE TABLE entrypoints (module INTEGER, address INTEGER, rva INTEGER, method_table INTEGER, method INTEGER)',
+    'CREATE TABLE stacktrace (module INTEGER, address INTEGER, rva INTEGER, name TEXT)',
+]
+
+INDEXES = [
+    'CREATE INDEX namespaces_full_name ON namespaces (full_name)',
+    'CREATE INDEX types_name ON types (name)',
+    'CREATE INDEX types_full_name ON types (full_name)',
+    'CREATE INDEX types_namespace ON types (module, namespace)',
+    'CREATE INDEX methods_name ON methods (name)',
+    'CREATE INDEX methods_owning_type ON methods (module, owning_type)',
+    'CREATE INDEX fields_name ON fields (name)',
+    'CREATE INDEX fields_owning_type ON fields (module, owning_type)',
+    'CREATE INDEX type_map_type ON type_map (module, type)',
+    'CREATE INDEX type_map_rva ON type_map (rva)',
+    'CREATE INDEX entrypoints_rva ON entrypoints (rva)',
+    'CREATE INDEX entrypoints_method ON entrypoints (module, method)',
+    'CREATE INDEX stacktrace_rva ON stacktrace (rva)',
+    'CREATE INDEX stacktrace_name ON stacktrace (name)',
+]
+
+TABLES = ['scopes', 'namespaces', 'types', 'methods', 'fields', 'strings', 'type_map', 'entrypoints', 'stacktrace']
+
+BATCH_SIZE = 10000
+
+#rows are queued per table and written out with executemany every BATCH_SIZE rows
+class RowWriter:
+    def __init__(self, connection, batch_size=BATCH_SIZE):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.pending = {table: list() for table in TABLES}
+        self.counts = {table: 0 for table in TABLES}
+
+    def add(self, table, row):
+        rows = self.pending[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def add_many(self, table, rows):
+        for row in rows:
+            self.add(table, row)
+
+    def flush(self, table=None):
+        for table in ([table] if table else TABLES):
+            rows = self.pending[table]
+            if rows:
+                placeholders = ', '.join('?' * len(rows[0]))
+                self.connection.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+                self.counts[table] += len(rows)
+                rows.clear()
+
+def string_or_none(metadata_reader, handle):
+    if handle.IsNull():
+        return None
+    return str(handle.GetConstantStringValue(metadata_reader))
+
+def flag_value(flags):
+    return flags.value if hasattr(flags, 'value') else int(flags)
+
+def write_metadata(session, rows):
+    metadata_reader = session.metadata_reader
+    if metadata_reader is None: #module without metadata
+        return
+    module = session.module_index
+
+    def walk_type(type_def_handle, namespace_offset, namespace_name, enclosing_offset, enclosing_name):
+        type_def = type_def_handle.GetTypeDefinition(metadata_reader)
+        name = string_or_none(metadata_reader, type_def.name)
+        if enclosing_name is not None:
+            full_name = f'{enclosing_name}+{name}'
+        else:
+            full_name = f'{namespace_name}.{name}' if namespace_name else name
+        rows.add('types', (module, type_def_handle.Offset, namespace_offset, enclosing_offset, name, full_name, flag_value(type_def.flags)))
+        for method_handle in type_def.methods:
+            method = method_handle.GetMethod(metadata_reader)
+            rows.add('methods', (module, method_handle.Offset, type_def_handle.Offset, string_or_none(metadata_reader, method.name), flag_value(method.flags), flag_value(method.implFlags)))
+        for field_handle in type_def.fields:
+            field = field_handle.GetField(metadata_reader)
+            rows.add('fields', (module, field_handle.Offset, type_def_handle.Offset, string_or_none(metadata_reader, field.name), flag_value(field.flags), field.offset))
+        for nested_type_handle in type_def.nestedTypes:
+            walk_type(nested_type_handle, namespace_offset, namespace_name, type_def_handle.Offset, full_name)
+
+    def walk_namespace(ns_def_handle, scope_offset, parent_offset, parent_name):
+        ns_def = ns_def_handle.GetNamespaceDefinition(metadata_reader)
+        name = string_or_none(metadata_reader, ns_def.name)
+        full_name = '.'.join(part for part in (parent_name, name) if part)
+        rows.add('namespaces', (module, ns_def_handle.Offset, scope_offset, parent_offset, name, full_name))
+        for type_def_handle in ns_def.typeDefinitions:
+            walk_type(type_def_handle, ns_def_handle.Offset, full_name, None, None)
+        for child in ns_def.namespaceDefinitions:
+            walk_namespace(child, scope_offset, ns_def_handle.Offset, full_name)
+
+    for scope_definition_handle in metadata_reader.header.SCOPE_DEFINITIONS:
+        scope = scope_definition_handle.GetScopeDefinition(metadata_reader)
+        rows.add('scopes', (module, scope_definition_handle.Offset, string_or_none(metadata_reader, scope.name), string_or_none(metadata_reader, scope.moduleName), scope.majorVersion, scope.minorVersion, scope.buildNumber, scope.revisionNumber))
+        walk_namespace(scope.rootNamespaceDefinition, scope_definition_handle.Offset, None, '')
+
+    #everything above went through the string pool, so it now holds every string that was touched
+    rows.add_many('strings', ((module, offset, value) for (offset, value) in metadata_reader.string_pool.strings.items()))
+
+#if session.cache is filled in (see cache.py) the address tables come from there instead of being decoded again
+def write_addresses(session, rows, workers=None):
+    if session.metadata_reader is None:
+        return
+    image_base = session.bv.start
+    module = session.module_index
+    cached = module_cache(session)
+
+    typemap = cached.get('typemap')
+    if typemap is None:
+        typemap = collect_typemap(session, workers)
+    rows.add_many('type_map', ((module, method_table, method_table - image_base, type_offset) for (method_table, type_offset) in typemap))
+
+    entrypoints = cached.get('invoke_entrypoints')
+    if entrypoints is None:
+        entrypoints = collect_invokemap_entrypoints(session, workers)
+    rows.add_many('entrypoints', ((module, entrypoint, entrypoint - image_base, method_table, method) for (entrypoint, method_table, method) in entrypoints))
+
+    symbols = cached.get('stacktrace')
+    if symbols is None:
+        symbols = decode_stacktrace_symbols(session)
+    rows.add_many('stacktrace', ((module, address, address - image_base, name) for (address, name) in symbols))
+
+#every module in session.modules is exported, needs populate_sections and create_metadata_reader to have been run. Any tables already in the database at path are replaced
+#returns the number of rows written to each table
+def export_sqlite(session, path, workers=None):
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('PRAGMA journal_mode = MEMORY')
+        with connection: #one transaction for the whole export
+            for table in TABLES:
+                connection.execute(f'DROP TABLE IF EXISTS {table}')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            rows = RowWriter(connection)
+            for module in session.modules:
+                write_metadata(module, rows)
+                write_addresses(module, rows, workers)
+            rows.flush()
+            for statement in INDEXES:
+                connection.execute(statement)
+    finally:
+        connection.close()
+    return rows.counts
@@ -1,4 +1,3 @@
-from binaryninja import *
 from .rtr import *
 from .utils import *
 from .dotnet_enums import *
@@ -6,22 +5,29 @@ from .autogen.autogen_nativeformat import *
 from .nativeformat import *
 
 
-def ReadRelPtr32(address):
-    return address + s32(read32(address))
+def ReadRelPtr32(parser):
+    address = parser.GetAddress()
+    return address + s32(parser.GetUInt32())
 
 
 #based on this method: https://github.com/dotnet/runtime/blob/55eee324653e01cf28809d02b25a5b0894b58d22/src/coreclr/nativeaot/System.Private.StackTraceMetadata/src/Internal/StackTraceMetadata/StackTraceMetadata.cs#L323
-def stacktrace_metadata_dumper(bv):
+#returns (pMethod, name) for every entry, [] if the binary has no stack trace metadata. This only decodes, see apply_stacktrace_symbols for naming the functions
+#verbose prints every entry as it is decoded, which is far too slow for big binaries so only the dumper does it
+def decode_stacktrace_symbols(session, verbose=False):
+    if ReflectionMapBlob.BlobIdStackTraceMethodRvaToTokenMapping not in session.sections:
+        return []
+    session.metadata_reader.PredecodeNames() #the stack trace data names methods in code order, not metadata order
     currentOwningType = None
     currentSignature = None
     currentName = None
     currentMethodInst = None
-    metadata_reader = METADATA_READER()
-    (rvaToTokenMapBlob, rvaToTokenMapBlob_end) = find_section_start_end(ReflectionMapBlob.BlobIdStackTraceMethodRvaToTokenMapping)
+    metadata_reader = session.metadata_reader
+    (rvaToTokenMapBlob, rvaToTokenMapBlob_end) = find_section_start_end(session, ReflectionMapBlob.BlobIdStackTraceMethodRvaToTokenMapping)
     
-    reader = NativeReader(rvaToTokenMapBlob, rvaToTokenMapBlob_end-rvaToTokenMapBlob)
+    reader = get_section_reader(session, ReflectionMapBlob.BlobIdStackTraceMethodRvaToTokenMapping)
     parser = NativeParser(reader, 0)
     entryCount = s32(parser.GetUInt32())
+    symbols = list() #(pMethod, name) for every entry
     while parser.GetAddress() < rvaToTokenMapBlob_end:
         command = StackTraceDataCommand(parser.GetUInt8())
         
@@ -45,30 +51,53 @@ def stacktrace_metadata_dumper(bv):
             val = s32(parser.GetUnsigned())
             currentMethodInst = Handle(val, hType=HandleType.ConstantStringArray)
         
-        pMethod = ReadRelPtr32(parser.GetAddress())
-        parser.Seek(4)
+        pMethod = ReadRelPtr32(parser)
         nameStr = currentName.GetConstantStringValue(metadata_reader)
         
-        print('pMethod:', hex(pMethod))
-        print('Name', nameStr)
+        if verbose:
+            print('pMethod:', hex(pMethod))
+            print('Name', nameStr)
         if currentOwningType.hType == HandleType.TypeDefinition:
             typeDefinition = TypeDefinitionHandle(currentOwningType).GetTypeDefinition(metadata_reader)
             owning_type = typeDefinition.get_name(metadata_reader)
-            print('Owning type', owning_type)
+            if verbose:
+                print('Owning type', owning_type)
         elif currentOwningType.hType == HandleType.TypeReference:
             typeReference = TypeReferenceHandle(currentOwningType).GetTypeReference(metadata_reader)
             owning_type = typeReference.get_name(metadata_reader)
-            print('Owning type', typeReference.get_name(metadata_reader))
+            if verbose:
+                print('Owning type', owning_type)
         elif currentOwningType.hType == HandleType.TypeSpecification:
-            print('Type specification')
+            if verbose:
+                print('Type specification')
             typeSpecifiction = TypeSpecificationHandle(currentOwningType).GetTypeSpecification(metadata_reader)
             owning_type = typeSpecifiction.get_name(metadata_reader)
-            print('Type specification', owning_type)
-        bv.add_function(pMethod) # add funciton if one doesn't already exist at pMethod
-        func = bv.get_function_at(pMethod)
-        if func:
-            #if func.name.startswith('sub_'):
-            func.name = f'{owning_type}::{str(nameStr)}' #don't replace debugging/user generated names
-            #print(func.name)
-        else:
-            print('No function found at address', pMethod)
\ No newline at end of file
+            if verbose:
+                print('Type specification', owning_type)
+        symbols.append((pMethod, f'{owning_type}::{str(nameStr)}'))
+    return symbols
+
+#Every symbol goes in as one batch: analysis is held while the functions are created and named, all the symbols are defined inside a single bulk_modify_symbols, and the whole thing is a single undo action. Analysis runs once at the end
+def apply_stacktrace_symbols(bv, symbols):
+    if is_headless(bv):
+        return
+    existing = {func.start for func in bv.functions}
+    bv.set_analysis_hold(True)
+    undo_state = bv.begin_undo_actions()
+    try:
+        with bv.bulk_modify_symbols():
+            for (pMethod, name) in symbols:
+                if pMethod not in existing:
+                    bv.add_function(pMethod) # add funciton if one doesn't already exist at pMethod
+                    existing.add(pMethod)
+                #if func.name.startswith('sub_'): #don't replace debugging/user generated names
+                bv.define_user_symbol(Symbol(SymbolType.FunctionSymbol, pMethod, name))
+    finally:
+        bv.commit_undo_actions(undo_state)
+        bv.set_analysis_hold(False)
+    bv.update_analysis()
+
+def stacktrace_metadata_dumper(session):
+    symbols = decode_stacktrace_symbols(session, verbose=True)
+    apply_stacktrace_symbols(session.bv, symbols)
+    return symbols
\ No newline at end of file
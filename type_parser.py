@@ -1,4 +1,4 @@
-from binaryninja import *
+from .utils import *
 from .dotnet_enums import *
 from .nativeformat import *
 from .rtr import *
@@ -1,5 +1,11 @@
-from binaryninja import *
-import ctypes
+try:
+    from binaryninja import *
+except ImportError: #running without Binary Ninja, see headless.py
+    pass
+from .headless import PEImage
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+import os
 
 
 '''
@@ -7,53 +13,81 @@ Random utility classes that make working with the binary a little easier
 
 '''
 
-READER = None
+#Byte indexable stand-in for a blob that couldn't be loaded in one read. Every access goes back through the session's reader, so this is only a fallback
+class LazyBuffer:
+    def __init__(self, session, base, size):
+        self.session = session
+        self.base = base
+        self.size = size
 
-def read8(address): 
-    global READER
-    return READER.read8(address)  
+    def __len__(self):
+        return self.size
 
-def read16(address):
-    global READER
-    return READER.read16(address)
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.session.read(self.base + key.start, key.stop - key.start)
+        return self.session.read8(self.base + key)
 
-def read32(address):
-    global READER
-    return READER.read32(address)
-
-def read64(address):
-    global READER
-    return READER.read64(address)
-
-def read(address, read_len):
-    global READER
-    return READER.read(read_len, address)
+#The sign conversions are plain arithmetic (mask, then flip the sign bit and subtract it back out) since they sit on every varint/handle decode and going through ctypes for each one is slow
 
 #convert an unsigned byte to a signed byte
 def s8(val): 
-    return ctypes.c_byte(val & 0xff).value
+    return ((val & 0xff) ^ 0x80) - 0x80
 
 def u8(val):
-    return ctypes.c_ubyte(val & 0xff).value
+    return val & 0xff
 
 def s32(val):
-    return ctypes.c_int(val & 0xffffffff).value
+    return ((val & 0xffffffff) ^ 0x80000000) - 0x80000000
 
 def u32(val):
-    return ctypes.c_uint(val & 0xffffffff).value
+    return val & 0xffffffff
 
 def s64(val):
-    return ctypes.c_long(val).value
+    return ((val & 0xffffffffffffffff) ^ 0x8000000000000000) - 0x8000000000000000
 
 def u64(val):
-    return ctypes.c_ulong(val).value
+    return val & 0xffffffffffffffff
 
 def u16(val):
-    return ctypes.c_ushort(val).value
+    return val & 0xffff
     
 def s16(val):
-    return ctypes.c_short(val).value
-
-def initialize_utils(bv):
-    global READER
-    READER = bv.reader(0)
\ No newline at end of file
+    return ((val & 0xffff) ^ 0x8000) - 0x8000
+
+#true when bv is a headless.PEImage rather than a real BinaryView, i.e. there is nothing to annotate
+def is_headless(bv):
+    return isinstance(bv, PEImage)
+
+#the file the analysis belongs to: the .bndb (or the binary if it was never saved), or the PE for a headless.PEImage
+def database_path(bv):
+    if is_headless(bv):
+        return bv.path
+    return bv.file.filename
+
+#written to a temporary file first so a half written file is never picked up
+def write_file_atomic(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+#Worker side of the parallel passes (NativeHashTable.EnumerateParallel, RehydrateDataParallel): attaches to a shared memory block the parent created and yields a view of its first size bytes
+#The view is released and the block closed at the end of the with block, the parent is the one that unlinks it. Like close_mapping, a slice of the view that is still around keeps the block mapped until it goes away
+@contextmanager
+def attach_shared_memory(name, size):
+    try:
+        shared = SharedMemory(name=name, track=False) #the parent owns (and unlinks) the memory
+    except TypeError: #track was only added in 3.13
+        shared = SharedMemory(name=name)
+    view = shared.buf[:size]
+    try:
+        yield view
+    finally:
+        try:
+            view.release()
+            shared.close()
+        except BufferError:
+            pass